@@ -156,12 +156,45 @@ def boids_init():
     return boids
     
 
+# uniform grid of cubic cells, each holding the indices of the boids inside it.
+# cell_size should be at least the largest query radius, so that every neighbor
+# of a boid is in its own cell or one of the 26 cells around it
+class BoidGrid:
+    def __init__(self, boids, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, boid in enumerate(boids):
+            key = self.cell(boid.p)
+            if key in self.cells:
+                self.cells[key].append(i)
+            else:
+                self.cells[key] = [i]
+
+    def cell(self, p):
+        s = self.cell_size
+        return (floor(p.x / s), floor(p.y / s), floor(p.z / s))
+
+    # indices of all boids in the cell containing p and the cells around it
+    def nearby(self, p):
+        cx, cy, cz = self.cell(p)
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                for z in (cz - 1, cz, cz + 1):
+                    yield from self.cells.get((x, y, z), ())
+
+
 # return the list of boids that are radius distance or closer to boids[ix]
-def boids_get_neighbors(boids, ix, radius):
+# if a grid is given, only boids in the adjacent cells are checked
+def boids_get_neighbors(boids, ix, radius, grid=None):
     boid = boids[ix]
     radius_squared = radius ** 2
     
-    for i, other_boid in enumerate(boids):
+    if grid is not None and radius <= grid.cell_size:
+        candidates = ((i, boids[i]) for i in grid.nearby(boid.p))
+    else:
+        candidates = enumerate(boids)
+    
+    for i, other_boid in candidates:
         if i == ix:
             continue
         dist_squared = (other_boid.p - boid.p).length_squared
@@ -170,14 +203,14 @@ def boids_get_neighbors(boids, ix, radius):
         
 
 # make boids fly towards center of neighbors. modifies boids[ix].v
-def boids_fly_towards_center(boids):
+def boids_fly_towards_center(boids, grid=None):
     factor = 0.05 * params['fly_towards_center']
     
     for ix in range(len(boids)):
         center = Vector([0,0,0])
         n_neighbors = 0
         
-        for neighbor in boids_get_neighbors(boids, ix, params['visual_range']):
+        for neighbor in boids_get_neighbors(boids, ix, params['visual_range'], grid):
             center += neighbor.p
             n_neighbors += 1
         
@@ -186,25 +219,25 @@ def boids_fly_towards_center(boids):
             boids[ix].v += (center - boids[ix].p) * factor
 
 # make boids avoid others that are too close. modifies boids[ix].v
-def boids_avoid_collisions(boids):
+def boids_avoid_collisions(boids, grid=None):
     factor = 0.05 * params['avoid_collisions']
     dv = Vector([0,0,0])
     
     for ix in range(len(boids)):
-        for neighbor in boids_get_neighbors(boids, ix, params['collision_radius']):
+        for neighbor in boids_get_neighbors(boids, ix, params['collision_radius'], grid):
             dv += (boids[ix].p - neighbor.p)
         
         boids[ix].v += dv * factor
 
 # make boids match velocity of neighbors. modifies boids[ix].v
-def boids_match_velocity(boids):
+def boids_match_velocity(boids, grid=None):
     factor = 0.05 * params['match_velocity']
     
     for ix in range(len(boids)):
         avg_v = Vector([0,0,0])
         n_neighbors = 0
         
-        for neighbor in boids_get_neighbors(boids, ix, params['visual_range']):
+        for neighbor in boids_get_neighbors(boids, ix, params['visual_range'], grid):
             avg_v += neighbor.v
             n_neighbors += 1
         
@@ -278,9 +311,10 @@ def execute():
     boids = boids_init()
 
     for i in range(0, params['animation_length'], params['animation_step']):
-        boids_fly_towards_center(boids)
-        boids_avoid_collisions(boids)
-        boids_match_velocity(boids)
+        grid = BoidGrid(boids, max(params['visual_range'], params['collision_radius']))
+        boids_fly_towards_center(boids, grid)
+        boids_avoid_collisions(boids, grid)
+        boids_match_velocity(boids, grid)
         boids_limit_speed(boids)
         boids_stay_in_territory(boids)
         
@@ -0,0 +1,173 @@
+'''
+
+Leaf meshes shared by lsystem.py and leaf_panel.py: libraries of leaf shapes
+with the meshes built from them, packing many leaves into flat vertex and loop
+arrays, writing those into a mesh in bulk, and coloring leaves through one
+shared material. Face color attributes need Blender 3.0.
+
+'''
+import bpy
+import collections
+import colorsys
+import functools
+import numpy as np
+# sibling module, installed next to this file (see README)
+import leaf_contour
+
+LeafShape = collections.namedtuple('LeafShape', ['verts', 'faces', 'uvs'])
+LEAF_MESH_KEY = "leaf_mesh_key" # custom property tagging a cached mesh with its key
+
+# the hand-made leaf shapes of one add-on, built once from sources, a list of
+# (vertices, faces) plus uvs for some, and the leaf meshes built from them.
+# every add-on has its own, since their shape numbers and meshes differ
+class LeafLibrary:
+    def __init__(self, sources):
+        shapes = []
+        for source in sources:
+            verts = np.array(source[0], dtype=np.float32)
+            verts.setflags(write=False)
+            faces = tuple(tuple(face) for face in source[1])
+            uvs = tuple(source[2]) if len(source) > 2 else None
+            shapes.append(LeafShape(verts, faces, uvs))
+        self.shapes = tuple(shapes) # vertices are read-only float32 arrays, faces are tuples
+
+        # names of the leaf meshes by key, shared by every leaf object using
+        # them. the datablocks themselves are not kept, since undo, File > New
+        # or loading a file can free them
+        self.meshes = {}
+
+    # t is an index into shapes or a leaf_contour.LeafContour
+    def shape(self, t):
+        if isinstance(t, leaf_contour.LeafContour):
+            return LeafShape(*leaf_contour.contour_shape(t))
+        return self.shapes[t]
+
+    # the cached mesh for key, None if there is none, or it has been deleted,
+    # renamed or edited since. verts are the vertices it was built with
+    def mesh_cached(self, key, verts):
+        mesh = bpy.data.meshes.get(self.meshes.get(key, ""))
+        if mesh is None or mesh.get(LEAF_MESH_KEY) != repr(key) or mesh.is_editmode or len(mesh.vertices) != len(verts):
+            return None
+        co = np.empty(len(verts) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        if not np.allclose(co, np.ravel(verts), atol=1e-6):
+            return None
+        return mesh
+
+    def mesh_store(self, key, mesh):
+        mesh[LEAF_MESH_KEY] = repr(key)
+        self.meshes[key] = mesh.name
+
+# fill an empty mesh with polygons given as flat loop vertex indices plus the
+# first loop and loop count of every polygon
+def mesh_from_arrays(mesh, verts, loops, loop_start, loop_total):
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(verts, dtype=np.float32).ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loops, dtype=np.int32))
+    mesh.polygons.add(len(loop_start))
+    mesh.polygons.foreach_set("loop_start", np.ascontiguousarray(loop_start, dtype=np.int32))
+    if not mesh.polygons.bl_rna.properties['loop_total'].is_readonly: # derived from loop_start since Blender 4.0
+        mesh.polygons.foreach_set("loop_total", np.ascontiguousarray(loop_total, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    mesh.validate()
+
+# faces, a tuple of vertex index tuples, as flat loop vertex indices and loop counts
+@functools.lru_cache(maxsize=256)
+def face_loops(faces):
+    loops = np.array([i for face in faces for i in face], dtype=np.int64)
+    loop_total = np.array([len(face) for face in faces], dtype=np.int64)
+    return loops, loop_total
+
+# many leaves in one mesh. groups are (verts, faces, leaves): the (k, v, 3)
+# vertices of k copies of a shape with faces, and the number of each copy.
+# returns vertices, loops, loop starts, loop totals and the leaf of every polygon
+def pack_leaves(groups):
+    verts, loops, loop_total, face_leaf = [], [], [], []
+    n_verts = 0
+    for group_verts, faces, leaves in groups:
+        n, v = group_verts.shape[:2]
+        shape_loops, shape_total = face_loops(faces)
+        verts.append(group_verts.reshape(-1, 3))
+
+        offsets = n_verts + v * np.arange(n)
+        loops.append((shape_loops + offsets[:, None]).ravel())
+        loop_total.append(np.tile(shape_total, n))
+        face_leaf.append(np.repeat(leaves, len(shape_total)))
+        n_verts += n * v
+
+    loop_total = np.concatenate(loop_total)
+    return np.concatenate(verts), np.concatenate(loops), np.cumsum(loop_total) - loop_total, loop_total, np.concatenate(face_leaf)
+
+# name of the per-leaf color attribute of merged meshes, and of the custom
+# property holding the color of a single leaf object
+LEAF_COLOR_ATTRIBUTE = "leaf_color"
+LEAF_MATERIAL = "Leaf Color"
+LEAF_COLOR = (0.1, 0.45, 0.05, 1.0) # rgba of leaves given no color
+
+# count rgba colors around base (rgb): hue shifted by up to hue_range and
+# value scaled by up to value_range either way, drawn from rng
+def leaf_colors(count, base, hue_range, value_range, rng):
+    h, s, v = colorsys.rgb_to_hsv(*base)
+    h = (h + rng.uniform(-hue_range, hue_range, count)) % 1
+    v = np.clip(v * (1 + rng.uniform(-value_range, value_range, count)), 0, 1)
+    i = np.floor(h * 6).astype(np.int64) % 6
+    f = h * 6 - np.floor(h * 6)
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+    colors = np.ones((count, 4), dtype=np.float32)
+    colors[:, 0] = np.choose(i, (v, q, p, p, t, v))
+    colors[:, 1] = np.choose(i, (t, v, v, q, p, p))
+    colors[:, 2] = np.choose(i, (p, p, t, v, v, q))
+    return colors
+
+# one material for every leaf. its base color is the sum of the leaf_color
+# face attribute and the leaf_color object property: merged meshes have only
+# the first and single leaves only the second, and a missing one reads as black.
+# a material from before object colors is rebuilt
+def leaf_material():
+    material = bpy.data.materials.get(LEAF_MATERIAL)
+    if material is None:
+        material = bpy.data.materials.new(LEAF_MATERIAL)
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    if nodes.get("Object Color") is not None:
+        return material
+
+    nodes.clear()
+    links = material.node_tree.links
+    face = nodes.new('ShaderNodeAttribute')
+    face.name = "Face Color"
+    face.attribute_type = 'GEOMETRY'
+    face.attribute_name = LEAF_COLOR_ATTRIBUTE
+    face.location = (-600, 200)
+    obj = nodes.new('ShaderNodeAttribute')
+    obj.name = "Object Color"
+    obj.attribute_type = 'OBJECT'
+    obj.attribute_name = LEAF_COLOR_ATTRIBUTE
+    obj.location = (-600, -100)
+    add = nodes.new('ShaderNodeVectorMath')
+    add.operation = 'ADD'
+    add.location = (-350, 100)
+    bsdf = nodes.new('ShaderNodeBsdfPrincipled')
+    bsdf.location = (-150, 100)
+    output = nodes.new('ShaderNodeOutputMaterial')
+    output.location = (200, 100)
+    links.new(face.outputs['Color'], add.inputs[0])
+    links.new(obj.outputs['Color'], add.inputs[1])
+    links.new(add.outputs['Vector'], bsdf.inputs['Base Color'])
+    links.new(bsdf.outputs['BSDF'], output.inputs['Surface'])
+    return material
+
+# color every polygon of mesh with the color of its leaf in one write, and
+# give it the shared leaf material
+def write_leaf_colors(mesh, colors, face_leaf):
+    attribute = mesh.attributes.new(LEAF_COLOR_ATTRIBUTE, 'FLOAT_COLOR', 'FACE')
+    attribute.data.foreach_set("color", np.ascontiguousarray(colors[face_leaf], dtype=np.float32).ravel())
+    mesh.materials.append(leaf_material())
+
+# color of a single leaf object (rgba), so objects sharing a leaf mesh can
+# still differ. the mesh needs the shared leaf material
+def set_leaf_color(obj, color):
+    obj[LEAF_COLOR_ATTRIBUTE] = [float(c) for c in color]
@@ -0,0 +1,94 @@
+'''
+
+Procedural leaf outlines for lsystem.py and leaf_panel.py. A LeafContour is
+a margin function sampled at a chosen resolution, so the same leaf can be
+built with a few vertices for the background or many for close-ups. Needs
+only numpy, like lsystem_turtle.
+
+'''
+import collections
+import functools
+from math import *
+import numpy as np
+
+# margin is one of MARGINS. resolution is about how many vertices go around the
+# outline, width is the half-width of the widest part for a leaf of length 1,
+# teeth is the number of teeth or lobes and depth how far they cut in (0 to 1)
+LeafContour = collections.namedtuple('LeafContour', ['margin', 'resolution', 'width', 'teeth', 'depth'])
+
+MARGINS = ('ENTIRE', 'SERRATED', 'LOBED', 'PALMATE')
+
+# how much of the half-width is left at t along the midrib (0 at the base, 1 at the tip)
+def midrib_margin(margin, t, teeth, depth):
+    if margin == 'SERRATED':
+        # saw teeth leaning towards the tip
+        return 1 - depth * (1 - np.modf(t * teeth)[0])
+    if margin == 'LOBED':
+        return 1 - depth * np.cos(pi * teeth * t) ** 2
+    return np.ones_like(t)
+
+# leaves along a midrib. both sides are sampled at the same heights, so the
+# outline is monotone in z and triangulates as a strip: a triangle at the
+# base, two per row, and a triangle at the tip
+def midrib_shape(contour):
+    rows = max(contour.resolution // 2, 2)
+    t = np.arange(1, rows) / rows
+    half = contour.width * np.sin(pi * t ** 0.7) * midrib_margin(contour.margin, t, contour.teeth, contour.depth)
+    half = np.maximum(half, 1e-4)
+
+    # 0 is the base, then right side up, the tip, and the left side down
+    x = np.concatenate(([0], half, [0], -half[::-1]))
+    z = np.concatenate(([0], t, [1], t[::-1]))
+
+    right = np.arange(1, rows)
+    left = 2 * rows - right
+    quads = np.stack((left[:-1], right[:-1], right[1:], left[1:]), axis=1)
+    faces = np.concatenate((
+        [[0, right[0], left[0]]],
+        quads[:, [0, 1, 2]],
+        quads[:, [0, 2, 3]],
+        [[left[-1], right[-1], rows]],
+    ))
+    return x, z, faces
+
+# palmate leaves: lobes radiating from a center, one sinus at the bottom where
+# the stem attaches. the outline is star-shaped around the center, so it
+# triangulates as a fan
+def palmate_shape(contour):
+    n = max(contour.resolution, 8)
+    phi = 2 * pi * np.arange(n) / n # from the top, counterclockwise
+    lobes = np.abs(np.sin(contour.teeth * (phi - pi) / 2))
+    r = (1 - contour.depth * (1 - lobes)) * (0.75 + 0.25 * np.cos(phi))
+    r = np.maximum(r, 1e-4)
+
+    # center first, then the outline. the bottom sinus, at r = 0.5 * (1 - depth)
+    # below the center, is the base. the lower lobes reach below it
+    x = np.concatenate(([0], -r * np.sin(phi) * contour.width * 2))
+    z = np.concatenate(([0], r * np.cos(phi))) + max(0.5 * (1 - contour.depth), 1e-4)
+    x /= z.max()
+    z /= z.max()
+
+    ring = np.arange(1, n + 1)
+    faces = np.stack((np.zeros(n, dtype=np.int64), ring, np.roll(ring, -1)), axis=1)
+    return x, z, faces
+
+# (vertices, faces, uvs) of contour, in the same form as the hand-made shapes:
+# the xz plane with the base at the origin and the tip at z = 1. vertices are
+# a read-only float32 array, faces are counterclockwise triangles
+@functools.lru_cache(maxsize=256)
+def contour_shape(contour):
+    if contour.margin not in MARGINS:
+        raise ValueError("unknown leaf margin {!r}".format(contour.margin))
+    if contour.margin == 'PALMATE':
+        x, z, faces = palmate_shape(contour)
+    else:
+        x, z, faces = midrib_shape(contour)
+
+    verts = np.zeros((len(x), 3), dtype=np.float32)
+    verts[:, 0] = x
+    verts[:, 2] = z
+    verts.setflags(write=False)
+
+    extent = max(np.abs(x).max(), 1e-7)
+    uvs = np.stack((0.5 + x / (2 * extent), (z - z.min()) / (z.max() - z.min())), axis=1)
+    return verts, tuple(map(tuple, faces.tolist())), tuple(map(tuple, uvs.tolist()))
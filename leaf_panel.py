@@ -4,7 +4,7 @@ bl_info = {
     "description": "Generate leaves with color variation",
     "author": "Lance Tan and Joyce Wu",
     "version": (1, 0),
-    'blender': (2, 80, 0),
+    'blender': (3, 0, 0),
     "location": "View3D > Tool",
     "wiki_url": "",
 }
@@ -13,6 +13,13 @@ import bpy
 from mathutils import Vector
 from math import radians
 import logging
+import time
+import functools
+import collections
+import numpy as np
+# sibling modules, installed next to this file (see README)
+import leaf_contour
+from leaf_buffers import LeafLibrary, mesh_from_arrays, pack_leaves, leaf_colors, leaf_material, write_leaf_colors, set_leaf_color
 
 class LeafProperties(bpy.types.PropertyGroup):
     leaf_shape_input : bpy.props.EnumProperty(
@@ -21,6 +28,23 @@ class LeafProperties(bpy.types.PropertyGroup):
         items=[('1', 'Ovate', 'Ovate'), ('2', 'Linear', 'Linear'), ('3', 'Cordate', 'Cordate'), ('4', 'Maple', 'Maple'), ('5', 'Palmate', 'Palmate'), ('6', 'Spiky Oak', 'Spiky Oak'), ('7', 'Rounded Oak', 'Rounded Oak'), ('8', 'Elliptic', 'Elliptic'), ('9', 'Rectangle', 'Rectangle'), ('10', 'Triangle', 'Triangle')
         ]
     )
+    leaf_margin : bpy.props.EnumProperty(name="Margin", items=[('SHAPE', 'Leaf Type', 'Use the hand-made outline of Leaf Type'), ('ENTIRE', 'Entire', 'Smooth outline along a midrib'), ('SERRATED', 'Serrated', 'Saw teeth along a midrib'), ('LOBED', 'Lobed', 'Rounded lobes along a midrib'), ('PALMATE', 'Palmate', 'Lobes radiating from the stem')])
+    leaf_resolution : bpy.props.IntProperty(name="Resolution", description="Vertices around a generated outline", default=24, min=8, max=1024)
+    leaf_width : bpy.props.FloatProperty(name="Width", default=0.3, min=0.01, max=2)
+    leaf_teeth : bpy.props.IntProperty(name="Teeth", description="Teeth or lobes of a generated outline", default=5, min=1, max=64)
+    leaf_depth : bpy.props.FloatProperty(name="Depth", description="How far teeth or lobes cut in", default=0.3, min=0, max=0.95)
+    leaf_color : bpy.props.FloatVectorProperty(name="Color", subtype='COLOR', default=(0.1, 0.45, 0.05), size=3, min=0, max=1)
+    bake_bend : bpy.props.BoolProperty(name="Bake Bend", description="Bend the leaf mesh once instead of adding a Simple Deform modifier", default=True)
+    batch_count : bpy.props.IntProperty(name="Count", default=100, min=1, max=1000000)
+    batch_shapes : bpy.props.EnumProperty(name="Shapes", items=[('SHAPES', 'Leaf Types', 'Every hand-made outline'), ('MARGINS', 'Margins', 'Every generated margin, with the settings above'), ('ALL', 'All', 'Both')])
+    batch_scale : bpy.props.FloatVectorProperty(name="Scale", description="Smallest and largest width scale", default=(0.4, 0.8), size=2, min=0.01)
+    batch_bend : bpy.props.FloatVectorProperty(name="Bend", description="Smallest and largest bend, in degrees", default=(0, 180), size=2, min=-360, max=360)
+    batch_spacing : bpy.props.FloatProperty(name="Spacing", default=1.5, min=0)
+    batch_seed : bpy.props.IntProperty(name="Seed", default=0)
+    batch_color : bpy.props.FloatVectorProperty(name="Color", subtype='COLOR', default=(0.1, 0.45, 0.05), size=3, min=0, max=1)
+    batch_hue_range : bpy.props.FloatProperty(name="Hue Variation", default=0.04, min=0, max=0.5)
+    batch_value_range : bpy.props.FloatProperty(name="Value Variation", default=0.3, min=0, max=1)
+    batch_color_seed : bpy.props.IntProperty(name="Color Seed", default=0)
 
 ##################################################################
 # LEAF GEN
@@ -31,33 +55,54 @@ class LeafGen(bpy.types.Operator):
     bl_label = "Generate Leaf"
     bl_options = {'REGISTER'}
     
-    def gen_leaf(leaf_type, scale, location, direction, bend_angle):
-        mesh = bpy.data.meshes.new(name="Leaf")
-        shape = leaf_shape(leaf_type)
-        verts = shape[0]
-        faces = shape[1]
-        for vert in verts:
-            vert.x *= scale
-            vert.y *= scale
-        mesh.from_pydata(verts, [], faces) 
-        
+    # leaf vertices, bent by bend_angle if bake. scale only applies to the width
+    @functools.lru_cache(maxsize=1024)
+    def leaf_verts(leaf_type, scale, bend_angle, bake):
+        verts = LEAF_LIBRARY.shape(leaf_type).verts * np.float32((scale, scale, 1))
+        if bake:
+            verts = bend_verts(verts, radians(bend_angle))
+        verts.setflags(write=False)
+        return verts
+
+    # mesh of a leaf shape, built once per (leaf_type, scale, bend_angle, bake)
+    def leaf_mesh(leaf_type, scale, bend_angle, bake=True):
+        key = (leaf_type, scale, bend_angle, bake)
+        verts = LeafGen.leaf_verts(leaf_type, scale, bend_angle, bake)
+        mesh = LEAF_LIBRARY.mesh_cached(key, verts)
+        if mesh is None:
+            shape = LEAF_LIBRARY.shape(leaf_type)
+            mesh = bpy.data.meshes.new(name="Leaf")
+            mesh.from_pydata(verts.tolist(), [], shape.faces)
+            mesh.materials.append(leaf_material())
+            LEAF_LIBRARY.mesh_store(key, mesh)
+        return mesh
+    
+    # bake bends the mesh itself, otherwise the leaf gets a modifier. color
+    # (rgba) is kept on the object, so leaves sharing a mesh can differ
+    def gen_leaf(leaf_type, scale, location, direction, bend_angle, color, bake=True):
+        mesh = LeafGen.leaf_mesh(leaf_type, scale, bend_angle, bake)
         obj = bpy.data.objects.new("Leaf", mesh)
         bpy.context.scene.collection.objects.link(obj)
         bpy.context.view_layer.objects.active = obj
         obj.select_get()
         
-        modifier = obj.modifiers.new(name='Bend', type='SIMPLE_DEFORM')
-        modifier.deform_method = 'BEND'
-        modifier.deform_axis = 'X'
-        modifier.angle = radians(bend_angle)
+        if not bake:
+            modifier = obj.modifiers.new(name='Bend', type='SIMPLE_DEFORM')
+            modifier.deform_method = 'BEND'
+            modifier.deform_axis = 'X'
+            modifier.angle = radians(bend_angle)
         
         obj.location = location
         obj.rotation_euler = direction
+        set_leaf_color(obj, color)
     
     def execute(self, context):
         mytool = context.scene.my_tool
-        leaf_type = int(mytool.leaf_shape_input) - 1
-        LeafGen.gen_leaf(leaf_type, 0.5, (1, 0.5, 0), (0.5, 1.0, -0.4), 180)
+        if mytool.leaf_margin == 'SHAPE':
+            leaf_type = int(mytool.leaf_shape_input) - 1
+        else:
+            leaf_type = panel_contour(mytool, mytool.leaf_margin)
+        LeafGen.gen_leaf(leaf_type, 0.5, (1, 0.5, 0), (0.5, 1.0, -0.4), 180, tuple(mytool.leaf_color) + (1,), mytool.bake_bend)
 #        mesh = bpy.data.meshes.new(name="Leaf")
 #        shape = leaf_shape(leaf_type)
 #        verts = shape[0]
@@ -69,250 +114,340 @@ class LeafGen(bpy.types.Operator):
 #        obj.select_get()
         return {'FINISHED'}
     
+##################################################################
+# LEAF BATCH
+##################################################################
+# a generated outline with the margin and the panel's contour settings
+def panel_contour(mytool, margin):
+    return leaf_contour.LeafContour(margin, mytool.leaf_resolution, mytool.leaf_width, mytool.leaf_teeth, mytool.leaf_depth)
+
+# the leaf types a batch picks from
+def batch_leaf_types(mytool):
+    leaf_types = []
+    if mytool.batch_shapes in ('SHAPES', 'ALL'):
+        leaf_types += range(len(LEAF_LIBRARY.shapes))
+    if mytool.batch_shapes in ('MARGINS', 'ALL'):
+        leaf_types += [panel_contour(mytool, margin) for margin in leaf_contour.MARGINS]
+    return leaf_types
+
+# one mesh worth of leaves. leaf i is leaf_types[i] with its width scaled by
+# scales[i], bent by bends[i] degrees and moved to locations[i]. leaves of
+# the same type are built together as (leaves, verts, 3) arrays. returns
+# vertices, loops, loop starts, loop totals and the leaf of every polygon
+def leaf_batch(leaf_types, scales, bends, locations):
+    by_type = collections.defaultdict(list)
+    for i, leaf_type in enumerate(leaf_types):
+        by_type[leaf_type].append(i)
+
+    groups = []
+    for leaf_type, leaves in by_type.items():
+        leaves = np.array(leaves)
+        shape = LEAF_LIBRARY.shape(leaf_type)
+        scale = np.ones((len(leaves), 1, 3), dtype=np.float32)
+        scale[:, 0, :2] = scales[leaves, None]
+        verts = bend_verts(shape.verts * scale, np.radians(bends[leaves])) + locations[leaves, None, :]
+        groups.append((verts, shape.faces, leaves))
+    return pack_leaves(groups)
+
+# Count random leaves on a grid at the 3D cursor, all in one mesh, each with
+# its own color
+class LeafBatchGen(bpy.types.Operator):
+    bl_idname = "object.leaf_batch_gen"
+    bl_category = "Leaf Generator"
+    bl_label = "Generate Leaf Batch"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        mytool = context.scene.my_tool
+        start = time.perf_counter()
+        n = mytool.batch_count
+        rng = np.random.default_rng(mytool.batch_seed % 2**32)
+        pool = batch_leaf_types(mytool)
+        leaf_types = [pool[i] for i in rng.integers(len(pool), size=n)]
+        scales = rng.uniform(*mytool.batch_scale, size=n)
+        bends = rng.uniform(*mytool.batch_bend, size=n)
+
+        columns = int(np.ceil(np.sqrt(n)))
+        locations = np.zeros((n, 3))
+        locations[:, 0] = np.arange(n) % columns * mytool.batch_spacing
+        locations[:, 1] = np.arange(n) // columns * mytool.batch_spacing
+
+        verts, loops, loop_start, loop_total, face_leaf = leaf_batch(leaf_types, scales, bends, locations)
+        mesh = bpy.data.meshes.new(name="Leaves")
+        mesh_from_arrays(mesh, verts, loops, loop_start, loop_total)
+        colors = leaf_colors(n, mytool.batch_color, mytool.batch_hue_range, mytool.batch_value_range, np.random.default_rng(mytool.batch_color_seed % 2**32))
+        write_leaf_colors(mesh, colors, face_leaf)
+        obj = bpy.data.objects.new("Leaves", mesh)
+        context.scene.collection.objects.link(obj)
+        context.view_layer.objects.active = obj
+        obj.location = context.scene.cursor.location
+
+        self.report({'INFO'}, "{} leaves, {} vertices in {:.2f} s".format(n, len(verts), time.perf_counter() - start))
+        return {'FINISHED'}
+
 ##################################################################
 # LEAF SHAPE
 ##################################################################
-def leaf_shape(t):
-    return [
-        (  # 1 = ovate
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.15, 0, 0.15]),
-                Vector([0.25, 0, 0.3]),
-                Vector([0.2, 0, 0.6]),
-                Vector([0, 0, 1]),
-                Vector([-0.2, 0, 0.6]),
-                Vector([-0.25, 0, 0.3]),
-                Vector([-0.15, 0, 0.15]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
-        ),
-        (  # 2 = linear
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.1, 0, 0.15]),
-                Vector([0.1, 0, 0.95]),
-                Vector([0, 0, 1]),
-                Vector([-0.1, 0, 0.95]),
-                Vector([-0.1, 0, 0.15]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 7, 8], [1, 2, 3], [3, 4, 5], [5, 6, 7], [1, 3, 5, 7]],
-        ),
-        (  # 3 = cordate
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.01, 0, 0.2]),
-                Vector([0.2, 0, 0.1]),
-                Vector([0.35, 0, 0.35]),
-                Vector([0.25, 0, 0.6]),
-                Vector([0.1, 0, 0.8]),
-                Vector([0, 0, 1]),
-                Vector([-0.1, 0, 0.8]),
-                Vector([-0.25, 0, 0.6]),
-                Vector([-0.35, 0, 0.35]),
-                Vector([-0.2, 0, 0.1]),
-                Vector([-0.01, 0, 0.2]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 11, 12],
-                [1, 2, 3, 4],
-                [11, 10, 9, 8],
-                [11, 1, 4, 8],
-                [8, 7, 6, 5, 4],
-            ],
-        ),
-        (  # 4 = maple
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.25, 0, 0.07]),
-                Vector([0.2, 0, 0.18]),
-                Vector([0.5, 0, 0.37]),
-                Vector([0.43, 0, 0.4]),
-                Vector([0.45, 0, 0.58]),
-                Vector([0.3, 0, 0.57]),
-                Vector([0.27, 0, 0.67]),
-                Vector([0.11, 0, 0.52]),
-                Vector([0.2, 0, 0.82]),
-                Vector([0.08, 0, 0.77]),
-                Vector([0, 0, 1]),
-                Vector([-0.08, 0, 0.77]),
-                Vector([-0.2, 0, 0.82]),
-                Vector([-0.11, 0, 0.52]),
-                Vector([-0.27, 0, 0.67]),
-                Vector([-0.3, 0, 0.57]),
-                Vector([-0.45, 0, 0.58]),
-                Vector([-0.43, 0, 0.4]),
-                Vector([-0.5, 0, 0.37]),
-                Vector([-0.2, 0, 0.18]),
-                Vector([-0.25, 0, 0.07]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 23, 24],
-                [1, 2, 3, 4, 5],
-                [23, 22, 21, 20, 19],
-                [1, 5, 6, 7, 8],
-                [23, 19, 18, 17, 16],
-                [1, 8, 9, 10, 11],
-                [23, 16, 15, 14, 13],
-                [1, 11, 12, 13, 23],
-            ],
-        ),
-        (  # 5 = palmate
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.25, 0, 0.1]),
-                Vector([0.5, 0, 0.3]),
-                Vector([0.2, 0, 0.45]),
-                Vector([0, 0, 1]),
-                Vector([-0.2, 0, 0.45]),
-                Vector([-0.5, 0, 0.3]),
-                Vector([-0.25, 0, 0.1]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 9, 10], [1, 2, 3, 4], [1, 4, 5, 6, 9], [9, 8, 7, 6]],
-        ),
-        (  # 6 = spiky oak
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.16, 0, 0.17]),
-                Vector([0.11, 0, 0.2]),
-                Vector([0.23, 0, 0.33]),
-                Vector([0.15, 0, 0.34]),
-                Vector([0.32, 0, 0.55]),
-                Vector([0.16, 0, 0.5]),
-                Vector([0.27, 0, 0.75]),
-                Vector([0.11, 0, 0.7]),
-                Vector([0.18, 0, 0.9]),
-                Vector([0.07, 0, 0.86]),
-                Vector([0, 0, 1]),
-                Vector([-0.07, 0, 0.86]),
-                Vector([-0.18, 0, 0.9]),
-                Vector([-0.11, 0, 0.7]),
-                Vector([-0.27, 0, 0.75]),
-                Vector([-0.16, 0, 0.5]),
-                Vector([-0.32, 0, 0.55]),
-                Vector([-0.15, 0, 0.34]),
-                Vector([-0.23, 0, 0.33]),
-                Vector([-0.11, 0, 0.2]),
-                Vector([-0.16, 0, 0.17]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 23, 24],
-                [1, 2, 3],
-                [3, 4, 5],
-                [5, 6, 7],
-                [7, 8, 9],
-                [9, 10, 11],
-                [1, 3, 5, 7, 9, 11, 12, 13, 15, 17, 19, 21, 23],
-                [23, 22, 21],
-                [21, 20, 19],
-                [19, 18, 17],
-                [17, 16, 15],
-                [15, 14, 13],
-            ],
-        ),
-        (  # 7 = round oak
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.11, 0, 0.16]),
-                Vector([0.11, 0, 0.2]),
-                Vector([0.22, 0, 0.26]),
-                Vector([0.23, 0, 0.32]),
-                Vector([0.15, 0, 0.34]),
-                Vector([0.25, 0, 0.45]),
-                Vector([0.23, 0, 0.53]),
-                Vector([0.16, 0, 0.5]),
-                Vector([0.23, 0, 0.64]),
-                Vector([0.2, 0, 0.72]),
-                Vector([0.11, 0, 0.7]),
-                Vector([0.16, 0, 0.83]),
-                Vector([0.12, 0, 0.87]),
-                Vector([0.06, 0, 0.85]),
-                Vector([0.07, 0, 0.95]),
-                Vector([0, 0, 1]),
-                Vector([-0.07, 0, 0.95]),
-                Vector([-0.06, 0, 0.85]),
-                Vector([-0.12, 0, 0.87]),
-                Vector([-0.16, 0, 0.83]),
-                Vector([-0.11, 0, 0.7]),
-                Vector([-0.2, 0, 0.72]),
-                Vector([-0.23, 0, 0.64]),
-                Vector([-0.16, 0, 0.5]),
-                Vector([-0.23, 0, 0.53]),
-                Vector([-0.25, 0, 0.45]),
-                Vector([-0.15, 0, 0.34]),
-                Vector([-0.23, 0, 0.32]),
-                Vector([-0.22, 0, 0.26]),
-                Vector([-0.11, 0, 0.2]),
-                Vector([-0.11, 0, 0.16]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 33, 34],
-                [1, 2, 3],
-                [3, 4, 5, 6],
-                [6, 7, 8, 9],
-                [9, 10, 11, 12],
-                [12, 13, 14, 15],
-                [15, 16, 17],
-                [1, 3, 6, 9, 12, 15, 17, 19, 22, 25, 28, 31, 33],
-                [33, 32, 31],
-                [31, 30, 29, 28],
-                [28, 27, 26, 25],
-                [25, 24, 23, 22],
-                [22, 21, 20, 19],
-                [19, 18, 17],
-            ],
-        ),
-        (  # 8 = elliptic (default)
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.15, 0, 0.2]),
-                Vector([0.25, 0, 0.45]),
-                Vector([0.2, 0, 0.75]),
-                Vector([0, 0, 1]),
-                Vector([-0.2, 0, 0.75]),
-                Vector([-0.25, 0, 0.45]),
-                Vector([-0.15, 0, 0.2]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
-        ),
-        (  # 9 = rectangle
-            [
-                Vector([-0.5, 0, 0]),
-                Vector([-0.5, 0, 1]),
-                Vector([0.5, 0, 1]),
-                Vector([0.5, 0, 0]),
-            ],
-            [[0, 1, 2, 3]],
-            [(0, 0), (0, 1), (1, 1), (1, 0)],
-        ),
-        (  # 10 = triangle
-            [Vector([-0.5, 0, 0]), Vector([0, 0, 1]), Vector([0.5, 0, 0])],
-            [[0, 1, 2]],
-            [(0, 0), (0.5, 1), (1, 0)],
-        ),
-    ][t]
+# leaf outlines in the xz plane, base at the origin and tip at z = 1:
+# (vertices, faces) plus uvs for some
+LEAF_SHAPE_SOURCES = [
+    (  # 1 = ovate
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.15, 0, 0.15),
+            (0.25, 0, 0.3),
+            (0.2, 0, 0.6),
+            (0, 0, 1),
+            (-0.2, 0, 0.6),
+            (-0.25, 0, 0.3),
+            (-0.15, 0, 0.15),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
+    ),
+    (  # 2 = linear
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.1, 0, 0.15),
+            (0.1, 0, 0.95),
+            (0, 0, 1),
+            (-0.1, 0, 0.95),
+            (-0.1, 0, 0.15),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 7, 8], [1, 2, 3], [3, 4, 5], [5, 6, 7], [1, 3, 5, 7]],
+    ),
+    (  # 3 = cordate
+        [
+            (0.005, 0, 0),
+            (0.01, 0, 0.2),
+            (0.2, 0, 0.1),
+            (0.35, 0, 0.35),
+            (0.25, 0, 0.6),
+            (0.1, 0, 0.8),
+            (0, 0, 1),
+            (-0.1, 0, 0.8),
+            (-0.25, 0, 0.6),
+            (-0.35, 0, 0.35),
+            (-0.2, 0, 0.1),
+            (-0.01, 0, 0.2),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 11, 12],
+            [1, 2, 3, 4],
+            [11, 10, 9, 8],
+            [11, 1, 4, 8],
+            [8, 7, 6, 5, 4],
+        ],
+    ),
+    (  # 4 = maple
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.25, 0, 0.07),
+            (0.2, 0, 0.18),
+            (0.5, 0, 0.37),
+            (0.43, 0, 0.4),
+            (0.45, 0, 0.58),
+            (0.3, 0, 0.57),
+            (0.27, 0, 0.67),
+            (0.11, 0, 0.52),
+            (0.2, 0, 0.82),
+            (0.08, 0, 0.77),
+            (0, 0, 1),
+            (-0.08, 0, 0.77),
+            (-0.2, 0, 0.82),
+            (-0.11, 0, 0.52),
+            (-0.27, 0, 0.67),
+            (-0.3, 0, 0.57),
+            (-0.45, 0, 0.58),
+            (-0.43, 0, 0.4),
+            (-0.5, 0, 0.37),
+            (-0.2, 0, 0.18),
+            (-0.25, 0, 0.07),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 23, 24],
+            [1, 2, 3, 4, 5],
+            [23, 22, 21, 20, 19],
+            [1, 5, 6, 7, 8],
+            [23, 19, 18, 17, 16],
+            [1, 8, 9, 10, 11],
+            [23, 16, 15, 14, 13],
+            [1, 11, 12, 13, 23],
+        ],
+    ),
+    (  # 5 = palmate
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.25, 0, 0.1),
+            (0.5, 0, 0.3),
+            (0.2, 0, 0.45),
+            (0, 0, 1),
+            (-0.2, 0, 0.45),
+            (-0.5, 0, 0.3),
+            (-0.25, 0, 0.1),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 9, 10], [1, 2, 3, 4], [1, 4, 5, 6, 9], [9, 8, 7, 6]],
+    ),
+    (  # 6 = spiky oak
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.16, 0, 0.17),
+            (0.11, 0, 0.2),
+            (0.23, 0, 0.33),
+            (0.15, 0, 0.34),
+            (0.32, 0, 0.55),
+            (0.16, 0, 0.5),
+            (0.27, 0, 0.75),
+            (0.11, 0, 0.7),
+            (0.18, 0, 0.9),
+            (0.07, 0, 0.86),
+            (0, 0, 1),
+            (-0.07, 0, 0.86),
+            (-0.18, 0, 0.9),
+            (-0.11, 0, 0.7),
+            (-0.27, 0, 0.75),
+            (-0.16, 0, 0.5),
+            (-0.32, 0, 0.55),
+            (-0.15, 0, 0.34),
+            (-0.23, 0, 0.33),
+            (-0.11, 0, 0.2),
+            (-0.16, 0, 0.17),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 23, 24],
+            [1, 2, 3],
+            [3, 4, 5],
+            [5, 6, 7],
+            [7, 8, 9],
+            [9, 10, 11],
+            [1, 3, 5, 7, 9, 11, 12, 13, 15, 17, 19, 21, 23],
+            [23, 22, 21],
+            [21, 20, 19],
+            [19, 18, 17],
+            [17, 16, 15],
+            [15, 14, 13],
+        ],
+    ),
+    (  # 7 = round oak
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.11, 0, 0.16),
+            (0.11, 0, 0.2),
+            (0.22, 0, 0.26),
+            (0.23, 0, 0.32),
+            (0.15, 0, 0.34),
+            (0.25, 0, 0.45),
+            (0.23, 0, 0.53),
+            (0.16, 0, 0.5),
+            (0.23, 0, 0.64),
+            (0.2, 0, 0.72),
+            (0.11, 0, 0.7),
+            (0.16, 0, 0.83),
+            (0.12, 0, 0.87),
+            (0.06, 0, 0.85),
+            (0.07, 0, 0.95),
+            (0, 0, 1),
+            (-0.07, 0, 0.95),
+            (-0.06, 0, 0.85),
+            (-0.12, 0, 0.87),
+            (-0.16, 0, 0.83),
+            (-0.11, 0, 0.7),
+            (-0.2, 0, 0.72),
+            (-0.23, 0, 0.64),
+            (-0.16, 0, 0.5),
+            (-0.23, 0, 0.53),
+            (-0.25, 0, 0.45),
+            (-0.15, 0, 0.34),
+            (-0.23, 0, 0.32),
+            (-0.22, 0, 0.26),
+            (-0.11, 0, 0.2),
+            (-0.11, 0, 0.16),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 33, 34],
+            [1, 2, 3],
+            [3, 4, 5, 6],
+            [6, 7, 8, 9],
+            [9, 10, 11, 12],
+            [12, 13, 14, 15],
+            [15, 16, 17],
+            [1, 3, 6, 9, 12, 15, 17, 19, 22, 25, 28, 31, 33],
+            [33, 32, 31],
+            [31, 30, 29, 28],
+            [28, 27, 26, 25],
+            [25, 24, 23, 22],
+            [22, 21, 20, 19],
+            [19, 18, 17],
+        ],
+    ),
+    (  # 8 = elliptic (default)
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.15, 0, 0.2),
+            (0.25, 0, 0.45),
+            (0.2, 0, 0.75),
+            (0, 0, 1),
+            (-0.2, 0, 0.75),
+            (-0.25, 0, 0.45),
+            (-0.15, 0, 0.2),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
+    ),
+    (  # 9 = rectangle
+        [
+            (-0.5, 0, 0),
+            (-0.5, 0, 1),
+            (0.5, 0, 1),
+            (0.5, 0, 0),
+        ],
+        [[0, 1, 2, 3]],
+        [(0, 0), (0, 1), (1, 1), (1, 0)],
+    ),
+    (  # 10 = triangle
+        [(-0.5, 0, 0), (0, 0, 1), (0.5, 0, 0)],
+        [[0, 1, 2]],
+        [(0, 0), (0.5, 1), (1, 0)],
+    ),
+]
+
+LEAF_LIBRARY = LeafLibrary(LEAF_SHAPE_SOURCES)
+
+# what a Simple Deform modifier bending around X does: the leaf curls along z
+# into the y direction, angle over the whole z extent of the mesh. verts can
+# also be (leaves, verts, 3) with one angle per leaf
+def bend_verts(verts, angle):
+    angle = np.asarray(angle, dtype=verts.dtype)[..., None]
+    z = verts[..., 2]
+    extent = np.maximum(z.max(axis=-1, keepdims=True) - z.min(axis=-1, keepdims=True), 1e-7)
+    straight = np.abs(angle) < 1e-7
+    factor = np.where(straight, 1, angle) / extent
+    theta = z * factor
+    radius = verts[..., 1] - 1 / factor
+    bent = verts.copy()
+    bent[..., 1] = np.where(straight, verts[..., 1], radius * np.cos(theta) + 1 / factor)
+    bent[..., 2] = np.where(straight, z, -radius * np.sin(theta))
+    return bent
 
 ##################################################################
 # LEAF PANEL
@@ -328,10 +463,35 @@ class LeafPanel(bpy.types.Panel):
         layout = self.layout
         scene = context.scene
         mytool = scene.my_tool
-        layout.prop(mytool, "leaf_shape_input")
+        layout.prop(mytool, "leaf_margin")
+        if mytool.leaf_margin == 'SHAPE':
+            layout.prop(mytool, "leaf_shape_input")
+        else:
+            layout.prop(mytool, "leaf_resolution")
+            layout.prop(mytool, "leaf_width")
+            if mytool.leaf_margin != 'ENTIRE':
+                layout.prop(mytool, "leaf_teeth")
+                layout.prop(mytool, "leaf_depth")
+        layout.prop(mytool, "leaf_color")
+        layout.prop(mytool, "bake_bend")
         layout.operator(LeafGen.bl_idname)
+
+        row = layout.row()
+        row.label(text="Batch")
+        box = layout.box()
+        box.prop(mytool, "batch_count")
+        box.prop(mytool, "batch_shapes")
+        box.prop(mytool, "batch_scale")
+        box.prop(mytool, "batch_bend")
+        box.prop(mytool, "batch_spacing")
+        box.prop(mytool, "batch_seed")
+        box.prop(mytool, "batch_color")
+        box.prop(mytool, "batch_hue_range")
+        box.prop(mytool, "batch_value_range")
+        box.prop(mytool, "batch_color_seed")
+        box.operator(LeafBatchGen.bl_idname)
         
-classes = [LeafProperties, LeafGen, LeafPanel]
+classes = [LeafProperties, LeafGen, LeafBatchGen, LeafPanel]
 
 def register():
     for cls in classes:
@@ -12,7 +12,7 @@ bl_info = {
     "description": "Generate an interactive swarm of bees in a scene with flowers and grass",
     "author": "Lance Tan and Joyce Wu",
     "version": (1, 0),
-    'blender': (2, 80, 0),
+    'blender': (3, 0, 0),
     "location": "View3D > Tool",
 }
 
@@ -21,26 +21,67 @@ import bmesh
 from mathutils import Vector, Matrix, Euler
 from math import *
 import random
+import time
+import os
+import struct
+import sys
+import queue
+import threading
+import multiprocessing
+import hashlib
+import json
+import shutil
+import tempfile
+import functools
+import collections
+import numpy as np
+# sibling modules, installed next to this file (see README)
+import lsystem_turtle
+import leaf_contour
+from leaf_buffers import LeafLibrary, mesh_from_arrays, face_loops, pack_leaves, leaf_colors, leaf_material, write_leaf_colors, set_leaf_color, LEAF_COLOR
 
 SCENE_SIZE = 100
+BOIDS_ENGINE_VERSION = 2 # bump when a change to the simulation makes cached trajectories stale
+BOIDS_PAIR_CHUNK = 8192 # query boids per chunk in boids_np_neighbor_pairs
+BOIDS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "beehive_boid_cache")
+BOIDS_CACHE_MAX_BYTES = 2 * 2**30
+LSYSTEM_CACHE_MAX_BYTES = 256 * 2**20
+# rough memory cost of an object with its own mesh, and of a vertex and a face
+OBJECT_BYTES = 4096
+VERT_BYTES = 48
+FACE_BYTES = 64
+FLOWERS_WARN_OBJECTS = 50000 # TreeGen warns above this many flower objects
+FLOWERS_MAX_BYTES = 4 * 2**30 # and refuses to generate above this estimated RAM
+SUBTREE_TROPISM_STEP = 0.05 # SubtreeInstancer reuses subtrees whose local tropism rounds to the same multiples of this
 class TreeProperties(bpy.types.PropertyGroup):
     leaf_types = [('1', 'Petal', 'Petal'), ('2', 'Ovate', 'Ovate'), ('3', 'Linear', 'Linear'), ('4', 'Cordate', 'Cordate'), ('5', 'Maple', 'Maple'), ('6', 'Palmate', 'Palmate'), ('7', 'Spiky Oak', 'Spiky Oak'), ('8', 'Rounded Oak', 'Rounded Oak'), ('9', 'Elliptic', 'Elliptic'), ('9', 'Rectangle', 'Rectangle'), ('10', 'Triangle', 'Triangle')]
     
     leaf_type : bpy.props.EnumProperty(name="Type", items=leaf_types)
     leaf_bend : bpy.props.FloatProperty(name="Bend", default=90, min=0, max=360)
     leaf_scale : bpy.props.FloatProperty(name="Scale", default=0.8)
+    leaf_margin : bpy.props.EnumProperty(name="Margin", items=[('SHAPE', 'Type', 'Use the hand-made outline of Type'), ('ENTIRE', 'Entire', 'Smooth outline along a midrib'), ('SERRATED', 'Serrated', 'Saw teeth along a midrib'), ('LOBED', 'Lobed', 'Rounded lobes along a midrib'), ('PALMATE', 'Palmate', 'Lobes radiating from the stem')])
+    leaf_resolution : bpy.props.IntProperty(name="Resolution", description="Vertices around a generated outline", default=24, min=8, max=1024)
+    leaf_width : bpy.props.FloatProperty(name="Width", default=0.3, min=0.01, max=2)
+    leaf_teeth : bpy.props.IntProperty(name="Teeth", description="Teeth or lobes of a generated outline", default=5, min=1, max=64)
+    leaf_depth : bpy.props.FloatProperty(name="Depth", description="How far teeth or lobes cut in", default=0.3, min=0, max=0.95)
+    leaf_bake : bpy.props.BoolProperty(name="Bake Twist", description="Twist the leaf meshes once instead of giving every leaf a Simple Deform modifier", default=True)
+    leaf_color : bpy.props.FloatVectorProperty(name="Color", description="Leaf color, varied per leaf", subtype='COLOR', default=(0.1, 0.45, 0.05), size=3, min=0, max=1)
+    leaf_hue_range : bpy.props.FloatProperty(name="Hue Variation", default=0.04, min=0, max=0.5)
+    leaf_value_range : bpy.props.FloatProperty(name="Value Variation", default=0.3, min=0, max=1)
+    leaf_color_seed : bpy.props.IntProperty(name="Color Seed", default=0)
     leaf_branch_angle : bpy.props.IntProperty(name="Leaf Branch Angle", default=41)
     branch_length : bpy.props.FloatProperty(name="Length", default=1.1, min=0.01)
     branch_length_scale : bpy.props.FloatProperty(name="Length Scale", default=1.1)
     branch_thickness : bpy.props.FloatProperty(name="Thickness", default=0.1)
     branch_angle : bpy.props.FloatProperty(name="Angle", default=35, min=0, max=360)
     n_iter : bpy.props.IntProperty(name="Level Count", default=1, min=1, max=5)
+    lstring_expansion : bpy.props.EnumProperty(name="Expansion", items=[('ARRAY', 'Arrays', 'Derive the L-string once as arrays, then draw it for every flower'), ('STREAM', 'Stream', 'Expand depth first straight into the turtle, without storing the L-string'), ('DAG', 'Shared', 'Expand every distinct module once and share the expansion between its copies')])
     tropism : bpy.props.FloatVectorProperty(name="Tropism", default=(0, 0, -1), size=3)
     tropism_scale : bpy.props.FloatProperty(name="Tropism Scale", default=0.22)
     seed : bpy.props.IntProperty(name="Seed", default=6)
-    bee_count : bpy.props.IntProperty(name="Count", default=50)
-    bee_visual_range : bpy.props.FloatProperty(name="Visual Range", default=7.5)
-    bee_collision_radius : bpy.props.FloatProperty(name="Collision Radius", default=2.0)
+    bee_count : bpy.props.IntProperty(name="Count", default=50, min=0)
+    bee_visual_range : bpy.props.FloatProperty(name="Visual Range", default=7.5, min=0.01)
+    bee_collision_radius : bpy.props.FloatProperty(name="Collision Radius", default=2.0, min=0.01)
     bee_homing_probability : bpy.props.FloatProperty(name="Homing Probability", default=0.05, min=0, max=1)
     bee_exploring_probability : bpy.props.FloatProperty(name="Exploring Probability", default=0.10, min=0, max=1)
     bee_fly_towards_center : bpy.props.FloatProperty(name="Fly Towards Center (Weight)", default=1.0, min=0, max=2.0)
@@ -48,7 +89,12 @@ class TreeProperties(bpy.types.PropertyGroup):
     bee_match_velocity : bpy.props.FloatProperty(name="Match Velocity (Weight)", default=1.0, min=0, max=2.0)
     bee_stay_in_territory: bpy.props.FloatProperty(name="Stay In Territory (Weight)", default=1.0, min=0, max=2.0)
     bee_seed : bpy.props.IntProperty(name="Seed", default=123456)
+    bee_output : bpy.props.EnumProperty(name="Output", items=[('OBJECTS', 'Objects', 'One animated object per bee'), ('POINT_CACHE', 'Point Cache', 'One point cloud driven by a cache file, with a bee instanced on every point')])
+    bee_engine : bpy.props.EnumProperty(name="Engine", items=[('NUMPY', 'NumPy', 'Simulate all bees at once with array operations'), ('PYTHON', 'Python', 'Simulate one bee at a time')])
+    bee_workers : bpy.props.IntProperty(name="Worker Processes", description="Split the NumPy simulation over this many processes", default=1, min=1, max=64)
     flower_count : bpy.props.IntProperty(name="Count", default=100)
+    flower_interpreter : bpy.props.EnumProperty(name="Interpreter", items=[('TURTLE', 'Turtle', 'Create objects while interpreting the L-string'), ('BUFFERS', 'Buffers', 'Interpret the L-string into arrays first, then build all branches of a flower as one mesh')])
+    instance_repeats : bpy.props.BoolProperty(name="Instance Repeats", description="With Shared expansion, build every repeated subtree once and place its copies as collection instances. Copies share their random twists. With tropism, only copies facing about the same way share a build", default=False)
         
 class LNode:
     def __init__(self, l, *params):
@@ -70,6 +116,152 @@ class LNode:
                 ans.append(node_or_func)
         return ans
 
+# an L-string stored as arrays instead of a list of LNodes: one symbol code per
+# symbol, and all parameters in one float array. the parameters of symbol i are
+# params[offsets[i]:offsets[i+1]]. iterating it still yields LNodes
+class LString:
+    def __init__(self, codes, offsets, params):
+        self.codes = codes # uint8, ord() of each symbol
+        self.offsets = offsets # int64, len(codes) + 1
+        self.params = params # float64
+
+    def from_nodes(lnodes):
+        codes = np.array([ord(node.l) for node in lnodes], dtype=np.uint8)
+        counts = [len(node.params) for node in lnodes]
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        params = np.array([x for node in lnodes for x in node.params], dtype=np.float64)
+        return LString(codes, offsets, params)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        offsets = self.offsets.tolist()
+        params = self.params.tolist()
+        for i, code in enumerate(self.codes.tolist()):
+            yield LNode(chr(code), *params[offsets[i]:offsets[i+1]])
+
+    def n_params(self):
+        return np.diff(self.offsets)
+
+    def nbytes(self):
+        return self.codes.nbytes + self.offsets.nbytes + self.params.nbytes
+
+# the expansion of one module by LSystem.expand_dag. children are terminal
+# LNodes or LExpansions shared with every other copy of the same module, so the
+# L-string is a DAG; iterating it yields the flat sequence of LNodes
+class LExpansion:
+    def __init__(self, children):
+        self.children = children
+        self.length = sum(len(child) if isinstance(child, LExpansion) else 1 for child in children)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        stack = [iter(self.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            elif isinstance(child, LExpansion):
+                stack.append(iter(child.children))
+            else:
+                yield child
+
+# a successor template like "!(thickness*1.73)?F(length)[&(branch_angle)F(length)A]",
+# parsed once. parameters are python expressions; their names are bound at
+# expansion time to the values passed to bind() and to the formal parameters
+# of the predecessor, e.g. LProduction("F(x*length_scale)", ("x",))
+class LProduction:
+    def __init__(self, template, formals=()):
+        self.template = template
+        self.formals = formals
+        self.successors = [] # (symbol, parameter expressions, names they use)
+        i = 0
+        while i < len(template):
+            symbol = template[i]
+            exprs = []
+            i += 1
+            if i < len(template) and template[i] == '(':
+                # split on top level commas, expressions can have parentheses
+                depth = 0
+                start = i + 1
+                while True:
+                    ch = template[i]
+                    if ch == '(':
+                        depth += 1
+                    elif ch == ')':
+                        depth -= 1
+                    if depth == 0 or (depth == 1 and ch == ','):
+                        exprs.append(template[start:i])
+                        start = i + 1
+                        if depth == 0:
+                            break
+                    i += 1
+                i += 1
+            exprs = [LProduction.compile_expr(expr.strip(), template) for expr in exprs]
+            used = set()
+            for expr in exprs:
+                if isinstance(expr, str):
+                    used.add(expr)
+                elif not isinstance(expr, float):
+                    used.update(expr.co_names)
+            self.successors.append((symbol, exprs, used))
+
+    # numbers are evaluated right away and plain names are looked up later,
+    # only the rest stays a code object for eval
+    def compile_expr(expr, template):
+        code = compile(expr, template, 'eval')
+        if not code.co_names:
+            return float(eval(code))
+        if expr.isidentifier():
+            return expr
+        return code
+
+    def eval_expr(expr, names, scope):
+        if isinstance(expr, float):
+            return expr
+        if isinstance(expr, str):
+            return scope[expr] if expr in scope else names[expr]
+        return eval(expr, names, scope)
+
+    # successors for a rules dict. parameters that only depend on names are
+    # evaluated here, the others every time the rule is applied
+    def bind(self, **names):
+        ans = []
+        for index, (symbol, exprs, used) in enumerate(self.successors):
+            if used & set(self.formals):
+                ans.append(functools.partial(self.apply, index, names))
+            else:
+                ans.append(LNode(symbol, *(LProduction.eval_expr(expr, names, {}) for expr in exprs)))
+        return ans
+
+    def apply(self, index, names, node):
+        symbol, exprs, used = self.successors[index]
+        scope = dict(zip(self.formals, node.params))
+        return LNode(symbol, *(LProduction.eval_expr(expr, names, scope) for expr in exprs))
+
+    # identifies the successor a bound apply stands for, see LSystem.derivation_key
+    def key(self, index, names):
+        symbol, exprs, used = self.successors[index]
+        return (self.template, self.formals, index, [(name, names[name]) for name in sorted(used) if name in names])
+
+# compiled productions are shared by every rule set built from the same template
+@functools.lru_cache(maxsize=None)
+def lsystem_production(template, formals=()):
+    return LProduction(template, formals)
+
+# generations derived by LSystem.generate_lstring, by LSystem.derivation_key,
+# in least recently used order
+LSYSTEM_CACHE = {}
+
+# flat indices of the runs [starts[k], starts[k] + counts[k])
+def lstring_runs(starts, counts):
+    total = counts.sum()
+    return np.repeat(starts, counts) + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+
 class LSystem:
     def parse_lstring(s):
         i = 0
@@ -91,7 +283,163 @@ class LSystem:
     def lstring_to_str(lstring):
         return ''.join(str(lnode) for lnode in lstring)
 
-    def generate_lstring(axiom, rules, n_iter):
+    # rules map a symbol to its successors. each successor is either a
+    # constant LNode or a function of the predecessor LNode returning one; the
+    # function must only do arithmetic on the parameters, since it gets called
+    # once per generation with a whole column of parameters at a time
+    def compile_rules(rules):
+        compiled = {}
+        for l, successors in rules.items():
+            compiled[ord(l)] = [
+                node_or_func if callable(node_or_func) else (ord(node_or_func.l), node_or_func.params)
+                for node_or_func in successors
+            ]
+        return compiled
+
+    # apply compiled rules to every symbol of an LString at once
+    def rewrite(lstring, compiled):
+        codes = lstring.codes
+        n_params = lstring.n_params()
+        out_len = np.ones(len(codes), dtype=np.int64)
+        matches = []
+        for code, template in compiled.items():
+            ix = np.flatnonzero(codes == code)
+            if not len(ix):
+                continue
+            out_len[ix] = len(template)
+            # instances of a symbol with different parameter counts get their own columns
+            for count in np.unique(n_params[ix]):
+                group = ix[n_params[ix] == count]
+                matches.append((group, count, template))
+        out_start = np.cumsum(out_len) - out_len
+
+        # evaluate every template entry for all matches of a symbol at once
+        out_codes = np.empty(out_len.sum(), dtype=np.uint8)
+        out_n_params = np.empty(len(out_codes), dtype=np.int64)
+        successors = []
+        for group, count, template in matches:
+            columns = [lstring.params[lstring.offsets[group] + k] for k in range(count)]
+            for k, entry in enumerate(template):
+                if callable(entry):
+                    node = entry(LNode(None, *columns))
+                    code, params = ord(node.l), node.params
+                else:
+                    code, params = entry
+                dst = out_start[group] + k
+                out_codes[dst] = code
+                out_n_params[dst] = len(params)
+                successors.append((dst, params))
+
+        # symbols without a rule are copied with their parameters
+        kept = np.ones(len(codes), dtype=bool)
+        for group, count, template in matches:
+            kept[group] = False
+        kept = np.flatnonzero(kept)
+        out_codes[out_start[kept]] = codes[kept]
+        out_n_params[out_start[kept]] = n_params[kept]
+
+        out_offsets = np.zeros(len(out_codes) + 1, dtype=np.int64)
+        np.cumsum(out_n_params, out=out_offsets[1:])
+        out_params = np.empty(out_offsets[-1], dtype=np.float64)
+        dst = lstring_runs(out_offsets[out_start[kept]], n_params[kept])
+        out_params[dst] = lstring.params[lstring_runs(lstring.offsets[kept], n_params[kept])]
+        for dst, params in successors:
+            for k, x in enumerate(params):
+                out_params[out_offsets[dst] + k] = x
+
+        return LString(out_codes, out_offsets, out_params)
+
+    # axiom is a list of LNodes or an LString, returns an LString. all the
+    # generations derived on the way are kept in LSYSTEM_CACHE, so asking again
+    # with a different n_iter only applies the missing steps. the returned
+    # LString is shared with the cache and must not be modified
+    def generate_lstring(axiom, rules, n_iter, use_cache=True):
+        key = LSystem.derivation_key(axiom, rules) if use_cache else None
+        generations = LSYSTEM_CACHE.pop(key, None) if key else None
+        if generations is None:
+            generations = [axiom if isinstance(axiom, LString) else LString.from_nodes(axiom)]
+
+        if len(generations) <= n_iter:
+            compiled = LSystem.compile_rules(rules)
+            while len(generations) <= n_iter:
+                generations.append(LSystem.rewrite(generations[-1], compiled))
+
+        if key:
+            # most recently used last
+            LSYSTEM_CACHE[key] = generations
+            LSystem.evict_derivations()
+        return generations[n_iter]
+
+    # hash of an axiom and a rule set, None if a rule is a function that can't
+    # be told apart from a different one
+    def derivation_key(axiom, rules):
+        h = hashlib.sha1()
+        if isinstance(axiom, LString):
+            for array in (axiom.codes, axiom.offsets, axiom.params):
+                h.update(repr(len(array)).encode())
+                h.update(array.tobytes())
+        else:
+            h.update(repr([(node.l, node.params) for node in axiom]).encode())
+        for l in sorted(rules):
+            successors = []
+            for node_or_func in rules[l]:
+                if isinstance(node_or_func, LNode):
+                    successors.append((node_or_func.l, node_or_func.params))
+                elif isinstance(node_or_func, functools.partial) and isinstance(getattr(node_or_func.func, '__self__', None), LProduction):
+                    successors.append(node_or_func.func.__self__.key(*node_or_func.args))
+                else:
+                    return None
+            h.update(repr((l, successors)).encode())
+        return h.hexdigest()
+
+    # drop least recently used derivations until the cache fits in max_bytes,
+    # the most recent one is always kept
+    def evict_derivations(max_bytes=LSYSTEM_CACHE_MAX_BYTES):
+        total = sum(lstring.nbytes() for generations in LSYSTEM_CACHE.values() for lstring in generations)
+        while total > max_bytes and len(LSYSTEM_CACHE) > 1:
+            generations = LSYSTEM_CACHE.pop(next(iter(LSYSTEM_CACHE)))
+            total -= sum(lstring.nbytes() for lstring in generations)
+
+    # depth-first expansion that yields the symbols of generation n_iter one at
+    # a time. only the successors of one symbol per level are held in memory,
+    # and axiom can itself be a generator
+    def expand_lstring(axiom, rules, n_iter):
+        stack = [(iter(axiom), 0)]
+        while stack:
+            nodes, depth = stack[-1]
+            node = next(nodes, None)
+            if node is None:
+                stack.pop()
+            elif depth < n_iter and node.l in rules:
+                stack.append((iter(node.apply_rule(rules[node.l])), depth + 1))
+            else:
+                yield node
+
+    # memoized expansion: every (symbol, params, remaining depth) is expanded
+    # once into an LExpansion shared by all its copies. axiom is a list of
+    # LNodes or an LExpansion, whose sharing is kept
+    def expand_dag(axiom, rules, n_iter):
+        memo = {}
+        def expand(node, depth):
+            if isinstance(node, LExpansion):
+                # all children of an expansion belong to the same generation
+                key = (node, depth)
+                if key not in memo:
+                    memo[key] = LExpansion([expand(child, depth) for child in node.children])
+                return memo[key]
+            if depth == 0 or node.l not in rules:
+                return node
+            key = (node.l, node.params, depth)
+            if key not in memo:
+                memo[key] = LExpansion([expand(child, depth - 1) for child in node.apply_rule(rules[node.l])])
+            return memo[key]
+
+        if isinstance(axiom, LExpansion):
+            return expand(axiom, n_iter)
+        return LExpansion([expand(node, n_iter) for node in axiom])
+
+    # the list-of-LNodes implementation, kept to benchmark against
+    def generate_lstring_nodes(axiom, rules, n_iter):
         lstring = axiom    
         for i in range(n_iter):
             ans = []
@@ -103,37 +451,227 @@ class LSystem:
             lstring = ans
 
         return lstring
+
+    # number of each symbol in a list of LNodes
+    def symbol_counts(lnodes):
+        counts = {}
+        for node in lnodes:
+            counts[node.l] = counts.get(node.l, 0) + 1
+        return counts
+
+    # symbol a successor produces. functions that aren't bound LProductions
+    # are assumed to keep the predecessor's symbol, like F -> F(x*length_scale)
+    def successor_symbol(node_or_func, l):
+        if isinstance(node_or_func, LNode):
+            return node_or_func.l
+        if isinstance(node_or_func, functools.partial) and isinstance(getattr(node_or_func.func, '__self__', None), LProduction):
+            index = node_or_func.args[0]
+            return node_or_func.func.__self__.successors[index][0]
+        return l
+
+    # symbol counts after n_iter steps, without expanding anything: counts @ M^n,
+    # where M[a, b] is how many b's a rewrites to
+    def count_symbols(counts, rules, n_iter):
+        symbols = set(counts) | set(rules)
+        for l, successors in rules.items():
+            symbols.update(LSystem.successor_symbol(x, l) for x in successors)
+        symbols = sorted(symbols)
+        index = {l: i for i, l in enumerate(symbols)}
+
+        matrix = np.eye(len(symbols))
+        for l, successors in rules.items():
+            matrix[index[l]] = 0
+            for x in successors:
+                matrix[index[l], index[LSystem.successor_symbol(x, l)]] += 1
+
+        counts = np.array([counts.get(l, 0) for l in symbols], dtype=np.float64)
+        counts = counts @ np.linalg.matrix_power(matrix, n_iter)
+        return dict(zip(symbols, counts))
+
+    # python heap used by a list of LNodes. successors that are constant LNodes
+    # are shared between all their copies, so every node is only counted once
+    def lnodes_nbytes(lnodes):
+        nbytes = sys.getsizeof(lnodes)
+        seen = set()
+        for node in lnodes:
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            nbytes += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.params)
+            nbytes += sum(sys.getsizeof(x) for x in node.params)
+        return nbytes
+
+    # print symbols/sec and bytes/symbol of both implementations for each n_iter
+    def benchmark(axiom, rules, n_iters=range(1, 6)):
+        for n_iter in n_iters:
+            start = time.perf_counter()
+            lnodes = LSystem.generate_lstring_nodes(axiom, rules, n_iter)
+            nodes_time = time.perf_counter() - start
+            start = time.perf_counter()
+            lstring = LSystem.generate_lstring(axiom, rules, n_iter, use_cache=False)
+            array_time = time.perf_counter() - start
+
+            n = len(lstring)
+            print("n_iter {}: {} symbols".format(n_iter, n))
+            print("  LNode list: {:>12.0f} symbols/sec, {:>6.1f} bytes/symbol".format(n / nodes_time, LSystem.lnodes_nbytes(lnodes) / n))
+            print("  LString:    {:>12.0f} symbols/sec, {:>6.1f} bytes/symbol".format(n / array_time, lstring.nbytes() / n))
     
-    def draw_lstring(lstring, pos, **params):
-        turtle = Turtle(pos=pos, **params)
+    # flower numbers the flower for leaf colors
+    def draw_lstring(lstring, pos, flower=0, **params):
+        turtle = Turtle(pos=pos, flower=flower, **params)
         for lnode in lstring:
-            l, params = lnode.l, lnode.params
-            if l == 'F':
-                turtle.draw(params[0])
-            elif l == '[':
-                turtle.push_state()
-            elif l == ']':
-                turtle.pop_state()
-            elif l == '/':
-                turtle.rotate_h(params[0])
-            elif l == '\\':
-                turtle.rotate_h(-params[0])
-            elif l == '+':
-                turtle.rotate_u(params[0])
-            elif l == '-':
-                turtle.rotate_u(-params[0])
-            elif l == '&':
-                turtle.rotate_l(params[0])
-            elif l == '^':
-                turtle.rotate_l(-params[0])
-            elif l == '$':
-                turtle.rotate_horizontal()
-            elif l == '?':
-                turtle.rotate_h(360*random.random())
-            elif l == '!':
-                turtle.thickness = params[0]
-            elif l == 'L':
-                turtle.draw_leaf()
+            turtle.interpret(lnode)
+
+    # build a flower from lsystem_turtle.TurtleBuffers: one object with all
+    # its branches, plus the leaves. flower numbers the flower for leaf colors
+    def draw_buffers(buffers, flower=0, **params):
+        mesh = bpy.data.meshes.new(name="Flower")
+        mesh_from_arrays(mesh, *lsystem_turtle.branch_mesh(buffers, Branch.profile))
+        obj = bpy.data.objects.new("Flower", mesh)
+        bpy.context.scene.collection.objects.link(obj)
+
+        if params['leaf_bake']:
+            LSystem.draw_buffer_leaves(buffers, flower, **params)
+            return
+
+        # the leaf Branch.gen_branch puts halfway along every branch, colored
+        # like the baked leaves
+        halfway = (buffers.segment_start + buffers.segment_end) / 2
+        colors = LSystem.buffer_leaf_colors(len(halfway) + len(buffers.leaf_position), flower, **params)
+        for pos, color in zip(halfway.tolist(), colors):
+            Leaf.gen_leaf(1, 1, Vector(pos), (-1, -1, random.choice((-1, 1))), 40, bake=params['leaf_bake'], color=color)
+        for pos, frame, color in zip(buffers.leaf_position.tolist(), buffers.leaf_frame.tolist(), colors[len(halfway):]):
+            euler = Matrix(frame).to_euler('XYZ')
+            Leaf.gen_leaf(params['leaf_type'], params['leaf_scale'], Vector(pos), euler, params['leaf_bend'], bake=params['leaf_bake'], color=color)
+
+    # colors of the count leaves of a flower, halfway leaves first
+    def buffer_leaf_colors(count, flower, **params):
+        rng = np.random.default_rng([params['leaf_color_seed'] % 2**32, flower])
+        return leaf_colors(count, params['leaf_color'], params['leaf_hue_range'], params['leaf_value_range'], rng)
+
+    # all leaves of a flower as one object, placed like Leaf.gen_leaf places
+    # them, with a random color per leaf written in one attribute write
+    def draw_buffer_leaves(buffers, flower, **params):
+        halfway = (buffers.segment_start + buffers.segment_end) / 2
+        turns = np.array([Euler((-1, -1, z)).to_matrix() for z in (-1, 1)])
+        halfway_frames = turns[[random.choice((0, 1)) for pos in halfway]].reshape(-1, 3, 3)
+        verts, loops, loop_start, loop_total, face_leaf = leaves_arrays([
+            (1, 1, 40, halfway, halfway_frames),
+            (params['leaf_type'], params['leaf_scale'], params['leaf_bend'], buffers.leaf_position, buffers.leaf_frame),
+        ])
+
+        mesh = bpy.data.meshes.new(name="Leaves")
+        mesh_from_arrays(mesh, verts, loops, loop_start, loop_total)
+        colors = LSystem.buffer_leaf_colors(len(halfway) + len(buffers.leaf_position), flower, **params)
+        write_leaf_colors(mesh, colors, face_leaf)
+        obj = bpy.data.objects.new("Leaves", mesh)
+        bpy.context.scene.collection.objects.link(obj)
+
+# draws LExpansions, placing repeated subtrees as collection instances. every
+# subtree with balanced brackets that is drawn more than once is built once
+# around the origin, in the turtle's default frame, and reused for all its
+# copies, including the ones in other flowers drawn by the same instancer.
+# subtrees inside a built subtree are instanced too. tropism bends a subtree
+# towards a fixed world direction, so with tropism only copies facing about the
+# same way relative to it share a build
+class SubtreeInstancer:
+    def __init__(self, dag, copies=1):
+        self.occurrences = SubtreeInstancer.count_occurrences(dag, copies)
+        self.brackets = {}
+        self.built = {} # (expansion, thickness, tropism key) -> (collection, turtle state at the end)
+        self.n_instances = 0
+        self.local_frame = Turtle().frame()
+
+    # how often every LExpansion in dag gets drawn
+    def count_occurrences(dag, copies):
+        order = []
+        seen = {dag}
+        stack = [dag]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for child in node.children:
+                if isinstance(child, LExpansion) and child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+
+        # a node is passed on to its children once all its parents are counted
+        refs = {}
+        for node in order:
+            for child in node.children:
+                if isinstance(child, LExpansion):
+                    refs[child] = refs.get(child, 0) + 1
+        occurrences = {dag: copies}
+        ready = [dag]
+        while ready:
+            node = ready.pop()
+            for child in node.children:
+                if isinstance(child, LExpansion):
+                    occurrences[child] = occurrences.get(child, 0) + occurrences[node]
+                    refs[child] -= 1
+                    if not refs[child]:
+                        ready.append(child)
+        return occurrences
+
+    # lowest bracket depth and bracket depth at the end, relative to the start
+    def bracket_profile(self, expansion):
+        if expansion not in self.brackets:
+            lowest = depth = 0
+            for child in expansion.children:
+                if isinstance(child, LExpansion):
+                    child_lowest, child_depth = self.bracket_profile(child)
+                else:
+                    child_depth = {'[': 1, ']': -1}.get(child.l, 0)
+                    child_lowest = min(child_depth, 0)
+                lowest = min(lowest, depth + child_lowest)
+                depth += child_depth
+            self.brackets[expansion] = (lowest, depth)
+        return self.brackets[expansion]
+
+    def draw(self, dag, pos, flower=0, **params):
+        turtle = Turtle(pos=pos, flower=flower, **params)
+        self.draw_children(turtle, dag.children)
+
+    def draw_children(self, turtle, children):
+        for child in children:
+            if not isinstance(child, LExpansion):
+                turtle.interpret(child)
+            elif self.occurrences[child] > 1 and self.bracket_profile(child) == (0, 0):
+                self.place(turtle, child)
+            else:
+                self.draw_children(turtle, child.children)
+
+    # tropism in the subtree's own frame, rounded so nearly equal ones match
+    def tropism_key(tropism):
+        if tropism is None:
+            return None
+        return tuple(round(x / SUBTREE_TROPISM_STEP) for x in tropism)
+
+    def place(self, turtle, expansion):
+        # rotation from the default frame the subtree is built in to the turtle's frame
+        rot = turtle.frame() @ self.local_frame.transposed()
+        tropism = rot.transposed() @ Vector(turtle.tropism) if turtle.tropism and turtle.tropism_scale else None
+        key = (expansion, turtle.thickness, SubtreeInstancer.tropism_key(tropism))
+        if key not in self.built:
+            collection = bpy.data.collections.new("Subtree")
+            # leaf colors are drawn once, so every copy of a subtree shares them
+            local = Turtle(tropism=tropism, tropism_scale=turtle.tropism_scale, pos=Vector([0, 0, 0]), collection=collection, flower=turtle.flower, **turtle.params)
+            local.thickness = turtle.thickness
+            self.draw_children(local, expansion.children)
+            self.built[key] = (collection, (local.pos, local.basis, local.thickness))
+        collection, (pos, basis, thickness) = self.built[key]
+
+        obj = bpy.data.objects.new("Subtree", None)
+        obj.instance_type = 'COLLECTION'
+        obj.instance_collection = collection
+        obj.matrix_basis = Matrix.Translation(turtle.pos) @ rot.to_4x4()
+        (turtle.collection or bpy.context.scene.collection).objects.link(obj)
+        self.n_instances += 1
+
+        # continue from where the subtree left the turtle
+        turtle.pos = turtle.pos + rot @ pos
+        turtle.basis = rot @ basis
+        turtle.thickness = thickness
 
 class Branch(bpy.types.Operator):
     bl_idname = "object.branch_gen"
@@ -157,15 +695,21 @@ class Branch(bpy.types.Operator):
     
     verts = verts()
     faces = faces()
+    profile = [(vert.x, vert.y) for vert in verts]
     
-    def gen_branch(pos, dist, end, direction, thickness):
+    # collection is where the object goes, the scene if None. the halfway
+    # leaf gets leaf_color
+    def gen_branch(pos, dist, end, direction, thickness, collection=None, bake_leaf=True, leaf_color=None):
         branch_verts = [vert.xyz * thickness + pos.xyz for vert in Branch.verts]
         mesh = bpy.data.meshes.new(name="Branch")
         mesh.from_pydata(branch_verts, [], Branch.faces)
         obj = bpy.data.objects.new("Branch", mesh)
-        bpy.context.scene.collection.objects.link(obj)
-        bpy.context.view_layer.objects.active = obj
-        obj.select_get()
+        if collection is None:
+            bpy.context.scene.collection.objects.link(obj)
+            bpy.context.view_layer.objects.active = obj
+            obj.select_get()
+        else:
+            collection.objects.link(obj)
         
         bm = bmesh.new()
         bm.from_mesh(obj.data)
@@ -177,7 +721,7 @@ class Branch(bpy.types.Operator):
         bm.to_mesh(obj.data)
         obj.data.update()
         halfway_point = (end + pos) / 2.0 
-        Leaf.gen_leaf(1, 1, halfway_point, (-1, -1, random.choice((-1, 1))), 40)
+        Leaf.gen_leaf(1, 1, halfway_point, (-1, -1, random.choice((-1, 1))), 40, collection, bake_leaf, leaf_color)
         
 
 class Leaf(bpy.types.Operator):
@@ -186,72 +730,146 @@ class Leaf(bpy.types.Operator):
     bl_label = "Generate Leaf"
     bl_options = {'REGISTER'}
     
-    def gen_leaf(leaf_type, scale, location, direction, bend_angle):
-        mesh = bpy.data.meshes.new(name="Leaf")
-        shape = leaf_shape(leaf_type)
-        verts = shape[0]
-        faces = shape[1]
-        
-        verts = [vert.zxy * scale for vert in verts]
-        
-        mesh.from_pydata(verts, [], faces) 
-        
+    # leaf vertices along x, twisted by bend_angle if bake
+    @functools.lru_cache(maxsize=1024)
+    def leaf_verts(leaf_type, scale, bend_angle, bake):
+        verts = LEAF_LIBRARY.shape(leaf_type).verts[:, [2, 0, 1]] * scale
+        if bake:
+            verts = twist_verts(verts, radians(bend_angle))
+        verts.setflags(write=False)
+        return verts
+
+    # mesh of a leaf shape, built once per (leaf_type, scale, bend_angle, bake)
+    def leaf_mesh(leaf_type, scale, bend_angle, bake=True):
+        key = (leaf_type, scale, bend_angle, bake)
+        verts = Leaf.leaf_verts(leaf_type, scale, bend_angle, bake)
+        mesh = LEAF_LIBRARY.mesh_cached(key, verts)
+        if mesh is None:
+            loops, loop_total = face_loops(LEAF_LIBRARY.shape(leaf_type).faces)
+            mesh = bpy.data.meshes.new(name="Leaf")
+            mesh_from_arrays(mesh, verts, loops, np.cumsum(loop_total) - loop_total, loop_total)
+            mesh.materials.append(leaf_material())
+            LEAF_LIBRARY.mesh_store(key, mesh)
+        return mesh
+    
+    # collection is where the object goes, the scene if None. location is in
+    # the same space as the branches, which ignore the 3D cursor.
+    # bake twists the mesh itself, otherwise the leaf gets a modifier. color
+    # (rgba) is kept on the object, LEAF_COLOR if None
+    def gen_leaf(leaf_type, scale, location, direction, bend_angle, collection=None, bake=True, color=None):
+        mesh = Leaf.leaf_mesh(leaf_type, scale, bend_angle, bake)
         obj = bpy.data.objects.new("Leaf", mesh)
-        bpy.context.scene.collection.objects.link(obj)
-        bpy.context.view_layer.objects.active = obj
-        obj.select_get()
-        
-        obj.location = location + bpy.context.scene.cursor.location
+        if collection is None:
+            bpy.context.scene.collection.objects.link(obj)
+            bpy.context.view_layer.objects.active = obj
+            obj.select_get()
+        else:
+            collection.objects.link(obj)
+        obj.location = location
         obj.rotation_euler = direction
+        set_leaf_color(obj, LEAF_COLOR if color is None else color)
         
-        modifier = obj.modifiers.new(name='Bend', type='SIMPLE_DEFORM')
-        modifier.deform_method = 'TWIST'
-        modifier.deform_axis = 'X'
-        modifier.angle = radians(bend_angle)
+        if not bake:
+            modifier = obj.modifiers.new(name='Bend', type='SIMPLE_DEFORM')
+            modifier.deform_method = 'TWIST'
+            modifier.deform_axis = 'X'
+            modifier.angle = radians(bend_angle)
+
+# rotation of the turtle's frame about its own h (0), l (1) or u (2) axis.
+# angles come from a handful of rule constants, so the matrices are cached
+@functools.lru_cache(maxsize=256)
+def turtle_rotation(axis, deg):
+    mat = Matrix.Rotation(deg/180*pi, 3, 'XYZ'[axis])
+    mat.freeze()
+    return mat
 
 class Turtle:
-    def __init__(self, tropism=None, tropism_scale=0, pos=Vector([0,0,0]), **params):
-        # pushed to stack
+    # flower numbers the flower, for leaf colors
+    def __init__(self, tropism=None, tropism_scale=0, pos=Vector([0,0,0]), collection=None, flower=0, **params):
+        # pushed to stack. pos and basis are replaced, never modified in
+        # place, so the stack can hold them without copies
         self.pos = pos
-        self.h = Vector([0, 0, 1]) # heading
-        self.l = Vector([1, 0, 0]) # direction left
-        self.u = Vector([0, 1, 0]) # direction up
+        self.basis = Matrix(([0, 1, 0], [0, 0, 1], [1, 0, 0])) # columns h (heading) = z, l (direction left) = x, u (direction up) = y
         self.thickness = 0.05
         
         # not pushed to stack because they never change
         self.tropism = tropism
         self.params = params
         self.tropism_scale = tropism_scale
+        self.collection = collection # where branches and leaves go, the scene if None
+        self.flower = flower
+        self.leaf_rng = np.random.default_rng([params.get('leaf_color_seed', 0) % 2**32, flower])
         
         self.stack = []
+
+    @property
+    def h(self):
+        return self.basis.col[0]
+
+    @property
+    def l(self):
+        return self.basis.col[1]
+
+    @property
+    def u(self):
+        return self.basis.col[2]
+
+    # h, l and u as the columns of a 3x3 matrix
+    def frame(self):
+        return self.basis.copy()
+
+    def interpret(self, lnode):
+        l, params = lnode.l, lnode.params
+        if l == 'F':
+            self.draw(params[0])
+        elif l == '[':
+            self.push_state()
+        elif l == ']':
+            self.pop_state()
+        elif l == '/':
+            self.rotate_h(params[0])
+        elif l == '\\':
+            self.rotate_h(-params[0])
+        elif l == '+':
+            self.rotate_u(params[0])
+        elif l == '-':
+            self.rotate_u(-params[0])
+        elif l == '&':
+            self.rotate_l(params[0])
+        elif l == '^':
+            self.rotate_l(-params[0])
+        elif l == '$':
+            self.rotate_horizontal()
+        elif l == '?':
+            # a random angle is never reused, so it skips turtle_rotation's cache
+            self.basis = self.basis @ Matrix.Rotation(2*pi*random.random(), 3, 'X')
+        elif l == '!':
+            self.thickness = params[0]
+        elif l == 'L':
+            self.draw_leaf()
     
+    # rotating about one of the frame's own axes is a rotation about x, y or z
+    # applied on the right of the basis
     def rotate_h(self, deg):
-        mat = Matrix.Rotation(deg/180*pi, 4, self.h)
-        self.l.rotate(mat)
-        self.u.rotate(mat)
+        self.basis = self.basis @ turtle_rotation(0, deg)
     
     def rotate_l(self, deg):
-        mat = Matrix.Rotation(deg/180*pi, 4, self.l)
-        self.h.rotate(mat)
-        self.u.rotate(mat)
+        self.basis = self.basis @ turtle_rotation(1, deg)
     
     def rotate_u(self, deg):
-        mat = Matrix.Rotation(deg/180*pi, 4, self.u)
-        self.h.rotate(mat)
-        self.l.rotate(mat)
+        self.basis = self.basis @ turtle_rotation(2, deg)
     
-    def rotate_horiziontal(self):
-        v = Vector([0, 0, 1])
-        self.l = v.cross(h)
-        self.l.normalize()
-        self.u = self.h.cross(self.l)
+    def rotate_horizontal(self):
+        h = self.h
+        l = Vector([0, 0, 1]).cross(h)
+        l.normalize()
+        self.basis = Matrix([h, l, h.cross(l)])
+        self.basis.transpose()
         
     def draw(self, dist):
         end = self.pos + dist * self.h
-        mat = Matrix([self.h, self.l, self.u])
-        mat.transpose()
-        euler = mat.to_euler('XYZ')
-        Branch.gen_branch(self.pos, dist, end, euler, self.thickness)
+        euler = self.basis.to_euler('XYZ')
+        Branch.gen_branch(self.pos, dist, end, euler, self.thickness, self.collection, self.params.get('leaf_bake', True), self.leaf_color())
         self.pos = end
         
         if self.tropism and self.tropism_scale:
@@ -265,38 +883,46 @@ class Turtle:
                     
             if theta:
                 torque.normalize()
-                mat = Matrix.Rotation(theta * self.tropism_scale, 4, torque)
-                self.h.rotate(mat)
-                self.l.rotate(mat)
-                self.u.rotate(mat)
+                self.basis = Matrix.Rotation(theta * self.tropism_scale, 3, torque) @ self.basis
     
     def draw_leaf(self):
-        
-        mat = Matrix([self.h, self.l, self.u])
-        mat.transpose()
-        euler = mat.to_euler('XYZ')
-        
-        Leaf.gen_leaf(self.params['leaf_type'], self.params['leaf_scale'], self.pos, euler, self.params['leaf_bend'])
-        
+        euler = self.basis.to_euler('XYZ')
+        Leaf.gen_leaf(self.params['leaf_type'], self.params['leaf_scale'], self.pos, euler, self.params['leaf_bend'], self.collection, self.params.get('leaf_bake', True), self.leaf_color())
+
+    # color of the next leaf, varied around the leaf_color param
+    def leaf_color(self):
+        if 'leaf_color' not in self.params:
+            return LEAF_COLOR
+        return leaf_colors(1, self.params['leaf_color'], self.params['leaf_hue_range'], self.params['leaf_value_range'], self.leaf_rng)[0]
         
     def push_state(self):
-        state = [
-            self.pos.copy(),
-            self.h.copy(),
-            self.l.copy(),
-            self.u.copy(),
-            self.thickness
-        ]
-        self.stack.append(state)
+        self.stack.append((self.pos, self.basis, self.thickness))
     
     def pop_state(self):
-        [
-            self.pos,
-            self.h,
-            self.l,
-            self.u,
-            self.thickness
-        ] = self.stack.pop()    
+        self.pos, self.basis, self.thickness = self.stack.pop()
+
+    # print symbols/sec of interpret, branch and leaf objects included, like
+    # lsystem_turtle.benchmark does for HeadlessTurtle. params are flower_params.
+    # everything is drawn into a collection outside the scene and removed after
+    def benchmark(lstring, repeat=5, **params):
+        lnodes = list(lstring)
+        elapsed = 0
+        for i in range(repeat):
+            collection = bpy.data.collections.new("Benchmark")
+            turtle = Turtle(collection=collection, **params)
+            start = time.perf_counter()
+            for lnode in lnodes:
+                turtle.interpret(lnode)
+            elapsed += time.perf_counter() - start
+
+            meshes = {obj.data for obj in collection.objects}
+            for obj in list(collection.objects):
+                bpy.data.objects.remove(obj)
+            for mesh in meshes:
+                if not mesh.users:
+                    bpy.data.meshes.remove(mesh)
+            bpy.data.collections.remove(collection)
+        print("{} symbols: {:.0f} symbols/sec".format(len(lnodes), len(lnodes) * repeat / elapsed))
         
 class Field:
     def beehive(pos):
@@ -308,7 +934,7 @@ class Field:
         
     def draw():
         mesh = bpy.data.meshes.new(name="Grass Blade")
-        shape = leaf_shape(0)
+        shape = LEAF_LIBRARY.shape(0)
         verts = [
                     Vector([0, 0, 0]),
                     Vector([0, 0, 1]),
@@ -357,259 +983,288 @@ class Field:
         Field.beehive(Vector([-x, -x, 0]))
         Field.beehive(Vector([0, 0, 0]))
 
-def leaf_shape(t):
-    return [
-        (
-            [
-                Vector([0.1, 0, 0]),
-                Vector([0.25, 0, 0.3]),
-                Vector([0.1, 0, 0.4]),
-                Vector([0, 0, 0.3]),
-                Vector([-0.1, 0, 0.4]),
-                Vector([-0.25, 0, 0.3]),
-                Vector([-0.1, 0, 0]),
-            ],
-            [[0, 1, 2, 3, 4, 5]],
-        ),
-        (  # 1 = ovate
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.15, 0, 0.15]),
-                Vector([0.25, 0, 0.3]),
-                Vector([0.2, 0, 0.6]),
-                Vector([0, 0, 1]),
-                Vector([-0.2, 0, 0.6]),
-                Vector([-0.25, 0, 0.3]),
-                Vector([-0.15, 0, 0.15]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
-        ),
-        (  # 2 = linear
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.1, 0, 0.15]),
-                Vector([0.1, 0, 0.95]),
-                Vector([0, 0, 1]),
-                Vector([-0.1, 0, 0.95]),
-                Vector([-0.1, 0, 0.15]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 7, 8], [1, 2, 3], [3, 4, 5], [5, 6, 7], [1, 3, 5, 7]],
-        ),
-        (  # 3 = cordate
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.01, 0, 0.2]),
-                Vector([0.2, 0, 0.1]),
-                Vector([0.35, 0, 0.35]),
-                Vector([0.25, 0, 0.6]),
-                Vector([0.1, 0, 0.8]),
-                Vector([0, 0, 1]),
-                Vector([-0.1, 0, 0.8]),
-                Vector([-0.25, 0, 0.6]),
-                Vector([-0.35, 0, 0.35]),
-                Vector([-0.2, 0, 0.1]),
-                Vector([-0.01, 0, 0.2]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 11, 12],
-                [1, 2, 3, 4],
-                [11, 10, 9, 8],
-                [11, 1, 4, 8],
-                [8, 7, 6, 5, 4],
-            ],
-        ),
-        (  # 4 = maple
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.25, 0, 0.07]),
-                Vector([0.2, 0, 0.18]),
-                Vector([0.5, 0, 0.37]),
-                Vector([0.43, 0, 0.4]),
-                Vector([0.45, 0, 0.58]),
-                Vector([0.3, 0, 0.57]),
-                Vector([0.27, 0, 0.67]),
-                Vector([0.11, 0, 0.52]),
-                Vector([0.2, 0, 0.82]),
-                Vector([0.08, 0, 0.77]),
-                Vector([0, 0, 1]),
-                Vector([-0.08, 0, 0.77]),
-                Vector([-0.2, 0, 0.82]),
-                Vector([-0.11, 0, 0.52]),
-                Vector([-0.27, 0, 0.67]),
-                Vector([-0.3, 0, 0.57]),
-                Vector([-0.45, 0, 0.58]),
-                Vector([-0.43, 0, 0.4]),
-                Vector([-0.5, 0, 0.37]),
-                Vector([-0.2, 0, 0.18]),
-                Vector([-0.25, 0, 0.07]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 23, 24],
-                [1, 2, 3, 4, 5],
-                [23, 22, 21, 20, 19],
-                [1, 5, 6, 7, 8],
-                [23, 19, 18, 17, 16],
-                [1, 8, 9, 10, 11],
-                [23, 16, 15, 14, 13],
-                [1, 11, 12, 13, 23],
-            ],
-        ),
-        (  # 5 = palmate
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.25, 0, 0.1]),
-                Vector([0.5, 0, 0.3]),
-                Vector([0.2, 0, 0.45]),
-                Vector([0, 0, 1]),
-                Vector([-0.2, 0, 0.45]),
-                Vector([-0.5, 0, 0.3]),
-                Vector([-0.25, 0, 0.1]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 9, 10], [1, 2, 3, 4], [1, 4, 5, 6, 9], [9, 8, 7, 6]],
-        ),
-        (  # 6 = spiky oak
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.16, 0, 0.17]),
-                Vector([0.11, 0, 0.2]),
-                Vector([0.23, 0, 0.33]),
-                Vector([0.15, 0, 0.34]),
-                Vector([0.32, 0, 0.55]),
-                Vector([0.16, 0, 0.5]),
-                Vector([0.27, 0, 0.75]),
-                Vector([0.11, 0, 0.7]),
-                Vector([0.18, 0, 0.9]),
-                Vector([0.07, 0, 0.86]),
-                Vector([0, 0, 1]),
-                Vector([-0.07, 0, 0.86]),
-                Vector([-0.18, 0, 0.9]),
-                Vector([-0.11, 0, 0.7]),
-                Vector([-0.27, 0, 0.75]),
-                Vector([-0.16, 0, 0.5]),
-                Vector([-0.32, 0, 0.55]),
-                Vector([-0.15, 0, 0.34]),
-                Vector([-0.23, 0, 0.33]),
-                Vector([-0.11, 0, 0.2]),
-                Vector([-0.16, 0, 0.17]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 23, 24],
-                [1, 2, 3],
-                [3, 4, 5],
-                [5, 6, 7],
-                [7, 8, 9],
-                [9, 10, 11],
-                [1, 3, 5, 7, 9, 11, 12, 13, 15, 17, 19, 21, 23],
-                [23, 22, 21],
-                [21, 20, 19],
-                [19, 18, 17],
-                [17, 16, 15],
-                [15, 14, 13],
-            ],
-        ),
-        (  # 7 = round oak
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.11, 0, 0.16]),
-                Vector([0.11, 0, 0.2]),
-                Vector([0.22, 0, 0.26]),
-                Vector([0.23, 0, 0.32]),
-                Vector([0.15, 0, 0.34]),
-                Vector([0.25, 0, 0.45]),
-                Vector([0.23, 0, 0.53]),
-                Vector([0.16, 0, 0.5]),
-                Vector([0.23, 0, 0.64]),
-                Vector([0.2, 0, 0.72]),
-                Vector([0.11, 0, 0.7]),
-                Vector([0.16, 0, 0.83]),
-                Vector([0.12, 0, 0.87]),
-                Vector([0.06, 0, 0.85]),
-                Vector([0.07, 0, 0.95]),
-                Vector([0, 0, 1]),
-                Vector([-0.07, 0, 0.95]),
-                Vector([-0.06, 0, 0.85]),
-                Vector([-0.12, 0, 0.87]),
-                Vector([-0.16, 0, 0.83]),
-                Vector([-0.11, 0, 0.7]),
-                Vector([-0.2, 0, 0.72]),
-                Vector([-0.23, 0, 0.64]),
-                Vector([-0.16, 0, 0.5]),
-                Vector([-0.23, 0, 0.53]),
-                Vector([-0.25, 0, 0.45]),
-                Vector([-0.15, 0, 0.34]),
-                Vector([-0.23, 0, 0.32]),
-                Vector([-0.22, 0, 0.26]),
-                Vector([-0.11, 0, 0.2]),
-                Vector([-0.11, 0, 0.16]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [
-                [0, 1, 33, 34],
-                [1, 2, 3],
-                [3, 4, 5, 6],
-                [6, 7, 8, 9],
-                [9, 10, 11, 12],
-                [12, 13, 14, 15],
-                [15, 16, 17],
-                [1, 3, 6, 9, 12, 15, 17, 19, 22, 25, 28, 31, 33],
-                [33, 32, 31],
-                [31, 30, 29, 28],
-                [28, 27, 26, 25],
-                [25, 24, 23, 22],
-                [22, 21, 20, 19],
-                [19, 18, 17],
-            ],
-        ),
-        (  # 8 = elliptic (default)
-            [
-                Vector([0.005, 0, 0]),
-                Vector([0.005, 0, 0.1]),
-                Vector([0.15, 0, 0.2]),
-                Vector([0.25, 0, 0.45]),
-                Vector([0.2, 0, 0.75]),
-                Vector([0, 0, 1]),
-                Vector([-0.2, 0, 0.75]),
-                Vector([-0.25, 0, 0.45]),
-                Vector([-0.15, 0, 0.2]),
-                Vector([-0.005, 0, 0.1]),
-                Vector([-0.005, 0, 0]),
-            ],
-            [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
-        ),
-        (  # 9 = rectangle
-            [
-                Vector([-0.5, 0, 0]),
-                Vector([-0.5, 0, 1]),
-                Vector([0.5, 0, 1]),
-                Vector([0.5, 0, 0]),
-            ],
-            [[0, 1, 2, 3]],
-            [(0, 0), (0, 1), (1, 1), (1, 0)],
-        ),
-        (  # 10 = triangle
-            [Vector([-0.5, 0, 0]), Vector([0, 0, 1]), Vector([0.5, 0, 0])],
-            [[0, 1, 2]],
-            [(0, 0), (0.5, 1), (1, 0)],
-        ),
-    ][t]
+# leaf outlines in the xz plane, base at the origin and tip at z = 1:
+# (vertices, faces) plus uvs for some
+LEAF_SHAPE_SOURCES = [
+    (
+        [
+            (0.1, 0, 0),
+            (0.25, 0, 0.3),
+            (0.1, 0, 0.4),
+            (0, 0, 0.3),
+            (-0.1, 0, 0.4),
+            (-0.25, 0, 0.3),
+            (-0.1, 0, 0),
+        ],
+        [[0, 1, 2, 3, 4, 5]],
+    ),
+    (  # 1 = ovate
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.15, 0, 0.15),
+            (0.25, 0, 0.3),
+            (0.2, 0, 0.6),
+            (0, 0, 1),
+            (-0.2, 0, 0.6),
+            (-0.25, 0, 0.3),
+            (-0.15, 0, 0.15),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
+    ),
+    (  # 2 = linear
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.1, 0, 0.15),
+            (0.1, 0, 0.95),
+            (0, 0, 1),
+            (-0.1, 0, 0.95),
+            (-0.1, 0, 0.15),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 7, 8], [1, 2, 3], [3, 4, 5], [5, 6, 7], [1, 3, 5, 7]],
+    ),
+    (  # 3 = cordate
+        [
+            (0.005, 0, 0),
+            (0.01, 0, 0.2),
+            (0.2, 0, 0.1),
+            (0.35, 0, 0.35),
+            (0.25, 0, 0.6),
+            (0.1, 0, 0.8),
+            (0, 0, 1),
+            (-0.1, 0, 0.8),
+            (-0.25, 0, 0.6),
+            (-0.35, 0, 0.35),
+            (-0.2, 0, 0.1),
+            (-0.01, 0, 0.2),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 11, 12],
+            [1, 2, 3, 4],
+            [11, 10, 9, 8],
+            [11, 1, 4, 8],
+            [8, 7, 6, 5, 4],
+        ],
+    ),
+    (  # 4 = maple
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.25, 0, 0.07),
+            (0.2, 0, 0.18),
+            (0.5, 0, 0.37),
+            (0.43, 0, 0.4),
+            (0.45, 0, 0.58),
+            (0.3, 0, 0.57),
+            (0.27, 0, 0.67),
+            (0.11, 0, 0.52),
+            (0.2, 0, 0.82),
+            (0.08, 0, 0.77),
+            (0, 0, 1),
+            (-0.08, 0, 0.77),
+            (-0.2, 0, 0.82),
+            (-0.11, 0, 0.52),
+            (-0.27, 0, 0.67),
+            (-0.3, 0, 0.57),
+            (-0.45, 0, 0.58),
+            (-0.43, 0, 0.4),
+            (-0.5, 0, 0.37),
+            (-0.2, 0, 0.18),
+            (-0.25, 0, 0.07),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 23, 24],
+            [1, 2, 3, 4, 5],
+            [23, 22, 21, 20, 19],
+            [1, 5, 6, 7, 8],
+            [23, 19, 18, 17, 16],
+            [1, 8, 9, 10, 11],
+            [23, 16, 15, 14, 13],
+            [1, 11, 12, 13, 23],
+        ],
+    ),
+    (  # 5 = palmate
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.25, 0, 0.1),
+            (0.5, 0, 0.3),
+            (0.2, 0, 0.45),
+            (0, 0, 1),
+            (-0.2, 0, 0.45),
+            (-0.5, 0, 0.3),
+            (-0.25, 0, 0.1),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 9, 10], [1, 2, 3, 4], [1, 4, 5, 6, 9], [9, 8, 7, 6]],
+    ),
+    (  # 6 = spiky oak
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.16, 0, 0.17),
+            (0.11, 0, 0.2),
+            (0.23, 0, 0.33),
+            (0.15, 0, 0.34),
+            (0.32, 0, 0.55),
+            (0.16, 0, 0.5),
+            (0.27, 0, 0.75),
+            (0.11, 0, 0.7),
+            (0.18, 0, 0.9),
+            (0.07, 0, 0.86),
+            (0, 0, 1),
+            (-0.07, 0, 0.86),
+            (-0.18, 0, 0.9),
+            (-0.11, 0, 0.7),
+            (-0.27, 0, 0.75),
+            (-0.16, 0, 0.5),
+            (-0.32, 0, 0.55),
+            (-0.15, 0, 0.34),
+            (-0.23, 0, 0.33),
+            (-0.11, 0, 0.2),
+            (-0.16, 0, 0.17),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 23, 24],
+            [1, 2, 3],
+            [3, 4, 5],
+            [5, 6, 7],
+            [7, 8, 9],
+            [9, 10, 11],
+            [1, 3, 5, 7, 9, 11, 12, 13, 15, 17, 19, 21, 23],
+            [23, 22, 21],
+            [21, 20, 19],
+            [19, 18, 17],
+            [17, 16, 15],
+            [15, 14, 13],
+        ],
+    ),
+    (  # 7 = round oak
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.11, 0, 0.16),
+            (0.11, 0, 0.2),
+            (0.22, 0, 0.26),
+            (0.23, 0, 0.32),
+            (0.15, 0, 0.34),
+            (0.25, 0, 0.45),
+            (0.23, 0, 0.53),
+            (0.16, 0, 0.5),
+            (0.23, 0, 0.64),
+            (0.2, 0, 0.72),
+            (0.11, 0, 0.7),
+            (0.16, 0, 0.83),
+            (0.12, 0, 0.87),
+            (0.06, 0, 0.85),
+            (0.07, 0, 0.95),
+            (0, 0, 1),
+            (-0.07, 0, 0.95),
+            (-0.06, 0, 0.85),
+            (-0.12, 0, 0.87),
+            (-0.16, 0, 0.83),
+            (-0.11, 0, 0.7),
+            (-0.2, 0, 0.72),
+            (-0.23, 0, 0.64),
+            (-0.16, 0, 0.5),
+            (-0.23, 0, 0.53),
+            (-0.25, 0, 0.45),
+            (-0.15, 0, 0.34),
+            (-0.23, 0, 0.32),
+            (-0.22, 0, 0.26),
+            (-0.11, 0, 0.2),
+            (-0.11, 0, 0.16),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [
+            [0, 1, 33, 34],
+            [1, 2, 3],
+            [3, 4, 5, 6],
+            [6, 7, 8, 9],
+            [9, 10, 11, 12],
+            [12, 13, 14, 15],
+            [15, 16, 17],
+            [1, 3, 6, 9, 12, 15, 17, 19, 22, 25, 28, 31, 33],
+            [33, 32, 31],
+            [31, 30, 29, 28],
+            [28, 27, 26, 25],
+            [25, 24, 23, 22],
+            [22, 21, 20, 19],
+            [19, 18, 17],
+        ],
+    ),
+    (  # 8 = elliptic (default)
+        [
+            (0.005, 0, 0),
+            (0.005, 0, 0.1),
+            (0.15, 0, 0.2),
+            (0.25, 0, 0.45),
+            (0.2, 0, 0.75),
+            (0, 0, 1),
+            (-0.2, 0, 0.75),
+            (-0.25, 0, 0.45),
+            (-0.15, 0, 0.2),
+            (-0.005, 0, 0.1),
+            (-0.005, 0, 0),
+        ],
+        [[0, 1, 9, 10], [1, 2, 3, 4], [4, 5, 6], [6, 7, 8, 9], [4, 6, 9, 1]],
+    ),
+    (  # 9 = rectangle
+        [
+            (-0.5, 0, 0),
+            (-0.5, 0, 1),
+            (0.5, 0, 1),
+            (0.5, 0, 0),
+        ],
+        [[0, 1, 2, 3]],
+        [(0, 0), (0, 1), (1, 1), (1, 0)],
+    ),
+    (  # 10 = triangle
+        [(-0.5, 0, 0), (0, 0, 1), (0.5, 0, 0)],
+        [[0, 1, 2]],
+        [(0, 0), (0.5, 1), (1, 0)],
+    ),
+]
+
+LEAF_LIBRARY = LeafLibrary(LEAF_SHAPE_SOURCES)
+
+# what a Simple Deform modifier twisting around X does: every vertex turns
+# around the x axis by angle times its x over the x extent of the mesh
+def twist_verts(verts, angle):
+    extent = max(verts[:, 0].max() - verts[:, 0].min(), 1e-7)
+    theta = verts[:, 0] * (angle / extent)
+    c = np.cos(theta)
+    s = np.sin(theta)
+    twisted = verts.copy()
+    twisted[:, 1] = verts[:, 1] * c - verts[:, 2] * s
+    twisted[:, 2] = verts[:, 1] * s + verts[:, 2] * c
+    return twisted
+
+# leaves merged into one mesh. groups are (leaf_type, scale, bend_angle,
+# positions, frames): the baked Leaf.leaf_verts rotated by each (3, 3) frame
+# and moved to each position. leaves are numbered in group order. returns
+# vertices, loops, loop starts, loop totals and the leaf of every polygon
+def leaves_arrays(groups):
+    packed = []
+    n_leaves = 0
+    for leaf_type, scale, bend_angle, positions, frames in groups:
+        shape_verts = Leaf.leaf_verts(leaf_type, scale, bend_angle, True)
+        verts = np.einsum('nij,vj->nvi', frames, shape_verts) + positions[:, None, :]
+        packed.append((verts, LEAF_LIBRARY.shape(leaf_type).faces, n_leaves + np.arange(len(positions))))
+        n_leaves += len(positions)
+    return pack_leaves(packed)
 
 
 class TreePanel(bpy.types.Panel):
@@ -629,17 +1284,36 @@ class TreePanel(bpy.types.Panel):
         box = layout.box()
         box.prop(mytool, "flower_count")
         box.prop(mytool, "n_iter")
+        box.prop(mytool, "lstring_expansion")
+        box.prop(mytool, "flower_interpreter")
+        box.prop(mytool, "instance_repeats")
         row = box.row()
         row.prop(mytool, "tropism")
         box.prop(mytool, "tropism_scale")
         box.prop(mytool, "seed")
+        estimate = flowers_estimate(flower_params(mytool), mytool.flower_count)
+        box.label(text="About {:,.0f} objects, {:,.0f} verts, {:,.0f} faces".format(estimate['objects'], estimate['verts'], estimate['faces']))
+        box.label(text="About {:,.0f} MB".format(estimate['bytes'] / 2**20), icon='ERROR' if estimate['bytes'] > FLOWERS_MAX_BYTES else 'NONE')
         
         row = layout.row()
         row.label(text="Petal Parameters:")
         box = layout.box()
-        box.prop(mytool, "leaf_type")
+        box.prop(mytool, "leaf_margin")
+        if mytool.leaf_margin == 'SHAPE':
+            box.prop(mytool, "leaf_type")
+        else:
+            box.prop(mytool, "leaf_resolution")
+            box.prop(mytool, "leaf_width")
+            if mytool.leaf_margin != 'ENTIRE':
+                box.prop(mytool, "leaf_teeth")
+                box.prop(mytool, "leaf_depth")
         box.prop(mytool, "leaf_bend")
         box.prop(mytool, "leaf_scale")
+        box.prop(mytool, "leaf_bake")
+        box.prop(mytool, "leaf_color")
+        box.prop(mytool, "leaf_hue_range")
+        box.prop(mytool, "leaf_value_range")
+        box.prop(mytool, "leaf_color_seed")
         box.prop(mytool, "leaf_branch_angle")
         
         row = layout.row()
@@ -663,108 +1337,120 @@ class TreePanel(bpy.types.Panel):
         box.prop(mytool, "bee_match_velocity")
         box.prop(mytool, "bee_stay_in_territory")
         box.prop(mytool, "bee_seed")
+        box.prop(mytool, "bee_engine")
+        box.prop(mytool, "bee_workers")
+        box.prop(mytool, "bee_output")
         
         layout.operator(TreeGen.bl_idname)
 
 
 ### ==== BEGIN BOIDS STUFF ==== ###
 
+# state, position and velocity of every boid at every step, preallocated for
+# the whole animation instead of growing a list of Vector copies per boid
+class BoidHistory:
+    def __init__(self, n_frames, count):
+        self.state = np.zeros((n_frames, count), dtype=np.uint8) # index into Boid.STATES
+        self.p = np.zeros((n_frames, count, 3), dtype=np.float32)
+        self.v = np.zeros((n_frames, count, 3), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.state)
+
+    @property
+    def count(self):
+        return self.state.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.state.nbytes + self.p.nbytes + self.v.nbytes
+
+    # (states, positions, velocities) of one boid over all frames
+    def boid(self, ix):
+        return self.state[:, ix], self.p[:, ix], self.v[:, ix]
+
+    # frame consumer, see boids_run
+    def consume(self, frame, state, p, v):
+        self.state[frame], self.p[frame], self.v[frame] = state, p, v
+
+    def finish(self):
+        pass
+
+    def discard(self):
+        pass
+
+    def report(self):
+        # a (state, p.copy(), v.copy()) tuple per frame per boid, plus the list slot for it
+        entry = (Boid.STATE_FLOCKING, Vector(), Vector())
+        entry_bytes = sys.getsizeof(entry) + 2 * (sys.getsizeof(entry[1]) + 3 * 4) + 8
+        print("Boid history: {:.1f} MB in arrays, {:.1f} MB as lists of Vectors".format(
+            self.nbytes / 2**20, entry_bytes * self.state.size / 2**20))
+
+# number of recorded frames, including the starting one
+def boids_n_frames(params):
+    return len(range(0, params['animation_length'], params['animation_step'])) + 1
+
 class Boid:
     STATE_FLOCKING = "flocking"
     STATE_SEEKING = "seeking"
     STATE_WAITING = "waiting"
+    STATES = [STATE_FLOCKING, STATE_SEEKING, STATE_WAITING] # index is the state code used in arrays
+    STATE_CODES = {state: code for code, state in enumerate(STATES)}
     
-    def __init__(self, name, p, v):
+    # history is a BoidHistory shared by all boids, this boid's column is ix
+    def __init__(self, name, p, v, history=None, ix=0):
         self.name = name
         self.state = Boid.STATE_FLOCKING
         self.seeking_dest = None
         
         self.p = p # position
         self.v = v # velocity vector
-        self.history = [] # array of (state, p, v)
-        self.history.append( (self.state, self.p.copy(), self.v.copy()) )        
+        self.history = history
+        self.ix = ix
 
-    def draw(self, params):
+    # meshes come from gen_bee_meshes and are shared by every bee
+    def draw(self, params, meshes):
         # draw boid        
-        bpy.ops.mesh.primitive_uv_sphere_add(
-            enter_editmode=False, 
-            align='WORLD',
-            location=(0, 0, 0),
-            scale=(0.75, 0.75, 1)
-        )
-
-        bpy.context.object.name = self.name
-        bpy.context.object.data.name = self.name
+        obj = bpy.data.objects.new(self.name, meshes['body'])
+        bpy.context.scene.collection.objects.link(obj)
+        obj.scale = Vector((0.75, 0.75, 1))
         # bpy.ops.object.shade_smooth()
         # bpy.data.objects[name].scale = [scale, scale, scale]
 
-        obj = bpy.context.object
         obj.rotation_mode = 'QUATERNION'
         
         # add wings
-        right_wing = gen_right_wing()
-        right_verts = right_wing[0]
-        right_faces = right_wing[1]
-        mesh = bpy.data.meshes.new(name="Wing")
-        mesh.from_pydata(right_verts, [], right_faces) 
-        rwing_obj = bpy.data.objects.new(self.name+"_RWing", mesh)
+        rwing_obj = bpy.data.objects.new(self.name+"_RWing", meshes['right_wing'])
         bpy.context.scene.collection.objects.link(rwing_obj)
-        bpy.context.view_layer.objects.active = rwing_obj
         rwing_obj.parent = obj
         rwing_obj.location = Vector((0.0, -0.75, 0.46))
         rwing_obj.scale = Vector((3, 1, 3))
         rwing_obj.rotation_euler = Euler((0.0, -0.0, 0.0), 'XYZ')
         rwing_obj.rotation_mode = "ZXY"
         
-        left_wing = gen_left_wing()
-        left_verts = left_wing[0]
-        left_faces = left_wing[1]
-        mesh = bpy.data.meshes.new(name="Wing")
-        mesh.from_pydata(left_verts, [], left_faces) 
-        lwing_obj = bpy.data.objects.new(self.name+"_LWing", mesh)
+        lwing_obj = bpy.data.objects.new(self.name+"_LWing", meshes['left_wing'])
         bpy.context.scene.collection.objects.link(lwing_obj)
-        bpy.context.view_layer.objects.active = lwing_obj
         lwing_obj.parent = obj
         lwing_obj.location = Vector((0.0, -0.75, 0.46))
         lwing_obj.scale = Vector((3, 1, 3))
         lwing_obj.rotation_euler = Euler((0.0, -0.0, 0.0), 'XYZ')
         lwing_obj.rotation_mode = "ZXY"
 
-        for i, (state, p, v) in enumerate(self.history):
-            t = i * params['animation_step']
-            if t > params['animation_length']:
-                return
-
-            # location
-            obj.location = p
-            obj.keyframe_insert(data_path="location", frame=t)
-
-            # direction
-            # construct h, l, u
-            h = v.normalized()
-            up = Vector([0, 0, 1])
-            l = up.cross(h)
-            l.normalize()
-            u = h.cross(l)
-
-            # turn into angle
-            mat = Matrix([h, l, u])
-            mat.transpose()
-            
-            base_mat = Matrix.Rotation(pi/2, 4, "Y") @ Matrix.Rotation(-pi/2, 4, "Z")
-            base_mat = base_mat.to_3x3()
-            mat = mat @ base_mat
-            
-            quat = mat.to_quaternion()
-            obj.rotation_quaternion = quat
-            obj.keyframe_insert(data_path="rotation_quaternion", frame=t)
-        
+        # body, one keyframe per simulation step
+        states, locations, velocities = self.history.boid(self.ix)
+        frames = np.arange(len(self.history)) * params['animation_step']
+        keep = frames <= params['animation_length']
+        obj.location = locations[-1]
+        keyframes_write(obj, "location", frames[keep], locations[keep])
+        keyframes_write(obj, "rotation_quaternion", frames[keep], boids_orientations(velocities[keep]))
         
         # animate wings
         z_rotation = 0
         rotation_step = 1.5
         direction = 1
-        for t in range(0, params['animation_length'], 5):
+        wing_frames = range(0, params['animation_length'], 5)
+        rwing_rotation = np.zeros((len(wing_frames), 3), dtype=np.float32)
+        for k in range(len(wing_frames)):
             
             if (z_rotation >= 0):
                 direction = -1
@@ -772,10 +1458,72 @@ class Boid:
                 direction = 1
         
             z_rotation += (rotation_step * direction)
-            rwing_obj.rotation_euler.z = z_rotation
-            lwing_obj.rotation_euler.z = -z_rotation
-            lwing_obj.keyframe_insert(data_path="rotation_euler", frame=t)
-            rwing_obj.keyframe_insert(data_path="rotation_euler", frame=t)
+            rwing_rotation[k, 2] = z_rotation
+        lwing_rotation = rwing_rotation * (1, 1, -1)
+        rwing_obj.rotation_euler.z = rwing_rotation[-1, 2]
+        lwing_obj.rotation_euler.z = lwing_rotation[-1, 2]
+        keyframes_write(lwing_obj, "rotation_euler", wing_frames, lwing_rotation)
+        keyframes_write(rwing_obj, "rotation_euler", wing_frames, rwing_rotation)
+
+# rotation quaternions (w, x, y, z) that point the bee along each velocity
+# vector, the same orientation as building h, l, u and calling to_quaternion()
+def boids_orientations(velocities):
+    up = np.array([0, 0, 1], dtype=np.float32)
+    h = boids_np_normalize(velocities)
+    l = boids_np_normalize(np.cross(up, h))
+    u = np.cross(h, l)
+    base_mat = Matrix.Rotation(pi/2, 3, "Y") @ Matrix.Rotation(-pi/2, 3, "Z")
+    mats = np.stack([h, l, u], axis=2) @ np.array(base_mat, dtype=np.float32)
+
+    # convert from the largest of the four components to stay accurate
+    m = mats
+    sq = np.stack([
+        1 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2],
+        1 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2],
+        1 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2],
+        1 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2],
+    ], axis=1)
+    largest = np.argmax(sq, axis=1)
+    s = np.sqrt(np.maximum(sq[np.arange(len(m)), largest], 1e-12)) * 2
+    a = (m[:, 2, 1] - m[:, 1, 2]) / s
+    b = (m[:, 0, 2] - m[:, 2, 0]) / s
+    c = (m[:, 1, 0] - m[:, 0, 1]) / s
+    d = (m[:, 0, 1] + m[:, 1, 0]) / s
+    e = (m[:, 0, 2] + m[:, 2, 0]) / s
+    f = (m[:, 1, 2] + m[:, 2, 1]) / s
+    quats = np.select([largest[:, None] == k for k in range(4)], [
+        np.stack([s / 4, a, b, c], axis=1),
+        np.stack([a, s / 4, d, e], axis=1),
+        np.stack([b, d, s / 4, f], axis=1),
+        np.stack([c, e, f, s / 4], axis=1),
+    ])
+    quats /= np.linalg.norm(quats, axis=1)[:, None]
+
+    # q and -q are the same rotation, pick the one closest to the previous
+    # keyframe so the curves interpolate the short way around
+    flip = np.einsum('ij,ij->i', quats[1:], quats[:-1]) < 0
+    quats[1:][np.logical_xor.accumulate(flip)] *= -1
+    return quats
+
+# write keyframes for every channel of data_path in one go, creating the F-Curves
+# directly instead of calling keyframe_insert once per frame.
+# values has one row per frame and one column per channel
+def keyframes_write(obj, data_path, frames, values, group="Object Transforms"):
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(obj.name + "Action")
+    action = obj.animation_data.action
+    
+    values = np.asarray(values, dtype=np.float32)
+    co = np.empty((len(values), 2), dtype=np.float32)
+    co[:, 0] = frames
+    for index in range(values.shape[1]):
+        co[:, 1] = values[:, index]
+        fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+        fcurve.keyframe_points.add(len(co))
+        fcurve.keyframe_points.foreach_set("co", co.ravel())
+        fcurve.update()
 
 def boids_init(params):
     boids = []
@@ -800,63 +1548,97 @@ def boids_init(params):
     return boids
     
 
-# return the list of boids that are radius distance or closer to boids[ix]
-def boids_get_neighbors(boids, ix, radius):
-    boid = boids[ix]
-    radius_squared = radius ** 2
-    
-    for i, other_boid in enumerate(boids):
-        if i == ix:
-            continue
-        dist_squared = (other_boid.p - boid.p).length_squared
-        if dist_squared < radius_squared:
-            yield other_boid
-        
+# uniform grid of cubic cells, each holding the indices of the boids inside it.
+# cell_size should be at least the largest query radius, so that every neighbor
+# of a boid is in its own cell or one of the 26 cells around it
+class BoidGrid:
+    def __init__(self, boids, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, boid in enumerate(boids):
+            key = self.cell(boid.p)
+            if key in self.cells:
+                self.cells[key].append(i)
+            else:
+                self.cells[key] = [i]
 
-# make boids fly towards center of neighbors. modifies boids[ix].v
-def boids_fly_towards_center(boids, params):
-    factor = 0.05 * params['fly_towards_center']
-    
-    for ix in range(len(boids)):
-        if boids[ix].state is Boid.STATE_FLOCKING:
-            center = Vector([0,0,0])
-            n_neighbors = 0
-            
-            for neighbor in boids_get_neighbors(boids, ix, params['visual_range']):
-                center += neighbor.p
-                n_neighbors += 1
-            
-            if n_neighbors:
-                center = center / n_neighbors
-                boids[ix].v += (center - boids[ix].p) * factor
+    def cell(self, p):
+        s = self.cell_size
+        return (floor(p.x / s), floor(p.y / s), floor(p.z / s))
 
-# make boids avoid others that are too close. modifies boids[ix].v
-def boids_avoid_collisions(boids, params):
-    factor = 0.05 * params['avoid_collisions']
-    dv = Vector([0,0,0])
+    # indices of all boids in the cell containing p and the cells around it
+    def nearby(self, p):
+        cx, cy, cz = self.cell(p)
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                for z in (cz - 1, cz, cz + 1):
+                    yield from self.cells.get((x, y, z), ())
+
+
+# fly towards center, avoid collisions and match velocity with a single neighbor
+# search per boid
+def boids_flock(boids, params, grid=None):
+    visual_r2 = params['visual_range'] ** 2
+    collision_r2 = params['collision_radius'] ** 2
+    radius = max(params['visual_range'], params['collision_radius'])
+    center_factor = 0.05 * params['fly_towards_center']
+    avoid_factor = 0.05 * params['avoid_collisions']
+    match_factor = 0.05 * params['match_velocity']
+    use_grid = grid is not None and radius <= grid.cell_size
     
-    for ix in range(len(boids)):
-        if boids[ix].state is Boid.STATE_FLOCKING:
-            for neighbor in boids_get_neighbors(boids, ix, params['collision_radius']):
-                dv += (boids[ix].p - neighbor.p)
-            boids[ix].v += dv * factor
-
-# make boids match velocity of neighbors. modifies boids[ix].v
-def boids_match_velocity(boids, params):
-    factor = 0.05 * params['match_velocity']
+    # the first two rules only read positions, so they can share one pass.
+    # dv keeps accumulating from boid to boid
+    dvx = dvy = dvz = 0.0
+    neighbors = [None] * len(boids)
+    for ix, boid in enumerate(boids):
+        if boid.state is not Boid.STATE_FLOCKING:
+            continue
+        px, py, pz = boid.p
+        cx = cy = cz = 0.0
+        near = []
+        for i in (grid.nearby(boid.p) if use_grid else range(len(boids))):
+            if i == ix:
+                continue
+            qx, qy, qz = boids[i].p
+            dx, dy, dz = px - qx, py - qy, pz - qz
+            dist_squared = dx*dx + dy*dy + dz*dz
+            if dist_squared < visual_r2:
+                near.append(i)
+                cx += qx
+                cy += qy
+                cz += qz
+            if dist_squared < collision_r2:
+                dvx += dx
+                dvy += dy
+                dvz += dz
+        
+        v = boid.v
+        if near:
+            n = len(near)
+            v.x += (cx / n - px) * center_factor
+            v.y += (cy / n - py) * center_factor
+            v.z += (cz / n - pz) * center_factor
+        v.x += dvx * avoid_factor
+        v.y += dvy * avoid_factor
+        v.z += dvz * avoid_factor
+        neighbors[ix] = near
     
-    for ix in range(len(boids)):
-        if boids[ix].state is Boid.STATE_FLOCKING:
-            avg_v = Vector([0,0,0])
-            n_neighbors = 0
-            
-            for neighbor in boids_get_neighbors(boids, ix, params['visual_range']):
-                avg_v += neighbor.v
-                n_neighbors += 1
-            
-            if n_neighbors:
-                avg_v = avg_v / n_neighbors
-                boids[ix].v += (avg_v - boids[ix].v) * factor
+    # matching velocity reads the neighbors' updated velocities, so it needs
+    # its own pass, but can reuse the neighbor lists
+    for ix, near in enumerate(neighbors):
+        if not near:
+            continue
+        ax = ay = az = 0.0
+        for i in near:
+            qx, qy, qz = boids[i].v
+            ax += qx
+            ay += qy
+            az += qz
+        n = len(near)
+        v = boids[ix].v
+        v.x += (ax / n - v.x) * match_factor
+        v.y += (ay / n - v.y) * match_factor
+        v.z += (az / n - v.z) * match_factor
 
 # limit boids speed
 def boids_limit_speed(boids, params):
@@ -920,23 +1702,438 @@ def gen_left_wing():
         [[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]], #faces
     )
 
-def create_boids(params):
+# build the bee body and wing meshes once, to be linked by every bee object
+def gen_bee_meshes():
+    bm = bmesh.new()
+    # same sphere as primitive_uv_sphere_add with its default settings
+    size = {'radius': 1} if bpy.app.version >= (3, 0, 0) else {'diameter': 1}
+    bmesh.ops.create_uvsphere(bm, u_segments=32, v_segments=16, calc_uvs=True, **size)
+    body = bpy.data.meshes.new(name="Bee")
+    bm.to_mesh(body)
+    bm.free()
+    
+    meshes = {'body': body}
+    for key, wing in (('right_wing', gen_right_wing()), ('left_wing', gen_left_wing())):
+        mesh = bpy.data.meshes.new(name="Wing")
+        mesh.from_pydata(wing[0], [], wing[1])
+        meshes[key] = mesh
+    return meshes
+
+def beehive_positions():
     x = SCENE_SIZE / 2 - 4
-    beehive_pos = [
+    return [
         Vector((x, x, 0)),
         Vector((x, -x, 0)),
         Vector((-x, x, 0)),
         Vector((-x, -x, 0)),
         Vector((0,0,0))
     ]
-         
+
+### ==== NUMPY BOIDS ==== ###
+# same rules as above, but every boid is a row in a handful of contiguous arrays
+# and each rule is applied to all boids at once
+
+class BoidArrays:
+    # alloc(shape, dtype) returns a zeroed array, e.g. one in shared memory
+    def __init__(self, count, alloc=np.zeros):
+        self.p = alloc((count, 3), np.float32) # positions
+        self.v = alloc((count, 3), np.float32) # velocities
+        self.state = alloc((count,), np.int8) # index into Boid.STATES
+        self.dest = alloc((count, 3), np.float32) # beehive each seeking/waiting boid is heading to
+        self.sep = alloc((count, 3), np.float64) # collision avoidance of each boid in the current step
+
+        # the next step is written here, then swapped in
+        self.next_p = alloc((count, 3), np.float32)
+        self.next_v = alloc((count, 3), np.float32)
+        self.next_state = alloc((count,), np.int8)
+
+    def __len__(self):
+        return len(self.p)
+
+    def swap(self):
+        self.p, self.next_p = self.next_p, self.p
+        self.v, self.next_v = self.next_v, self.v
+        self.state, self.next_state = self.next_state, self.state
+
+def boids_np_init(params, rng, alloc=np.zeros):
+    r = params['territory_radius']
+    s = params['max_speed'] * 0.5
+    n = params['count']
+    p = np.empty((0, 3))
+    v = np.empty((0, 3))
+    while len(p) < n:
+        new_p = rng.random((n, 3)) * r - r/2
+        new_v = rng.random((n, 3)) * s - s/2
+        keep = new_p[:, 2] > 0
+        p = np.concatenate((p, new_p[keep]))
+        v = np.concatenate((v, new_v[keep]))
+
+    print("Created {} boids".format(n))
+    boids = BoidArrays(n, alloc)
+    boids.p[:] = p[:n]
+    boids.v[:] = v[:n]
+    return boids
+
+# random numbers for one step. they are drawn for every boid from a stream that
+# only depends on the seed and the frame, so any subset of the boids can be
+# stepped on its own and still get the numbers it would get in a serial run
+def boids_np_random(params, frame, n, n_beehives):
+    rng = np.random.default_rng([params['seed'] % 2**32, frame])
+    s = params['max_speed'] * 0.25
+    roll = rng.random(n)
+    beehive = rng.integers(n_beehives, size=n)
+    explore_v = rng.uniform(-s, s, (n, 3))
+    return roll, beehive, explore_v
+
+# all (i, j) index pairs with i != j that are closer than radius, together with
+# their squared distance. works like BoidGrid: boids are sorted by cell, and
+# each boid looks up the runs of boids in the 27 cells around it.
+# query and candidates are optional boolean masks limiting i and j. query boids
+# are handled chunk at a time and far candidates dropped right away, so dense
+# clusters never hold more than one chunk's candidates at once
+def boids_np_neighbor_pairs(p, radius, query=None, candidates=None, chunk=BOIDS_PAIR_CHUNK):
+    n = len(p)
+    if not n:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, p.dtype)
+    cell = np.floor(p / radius).astype(np.int64)
+    cell -= cell.min(axis=0) - 1 # keep an empty border so neighbor cells never wrap
+    dims = cell.max(axis=0) + 2
+    key = (cell[:, 0] * dims[1] + cell[:, 1]) * dims[2] + cell[:, 2]
+    query_ix = np.arange(n) if query is None else np.flatnonzero(query)
+    candidate_ix = np.arange(n) if candidates is None else np.flatnonzero(candidates)
+    order = candidate_ix[np.argsort(key[candidate_ix], kind='stable')]
+    sorted_key = key[order]
+    r2 = radius ** 2
+
+    pairs_i = []
+    pairs_j = []
+    pairs_d2 = []
+    for first in range(0, len(query_ix), chunk):
+        chunk_ix = query_ix[first:first + chunk]
+        chunk_key = key[chunk_ix]
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    cell_key = chunk_key + (dx * dims[1] + dy) * dims[2] + dz
+                    start = np.searchsorted(sorted_key, cell_key, side='left')
+                    count = np.searchsorted(sorted_key, cell_key, side='right') - start
+                    total = count.sum()
+                    if not total:
+                        continue
+                    # expand each [start, start + count) run into one entry per candidate
+                    run_offset = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+                    i = np.repeat(chunk_ix, count)
+                    j = order[np.repeat(start, count) + run_offset]
+                    d = p[j] - p[i]
+                    d2 = np.einsum('ij,ij->i', d, d)
+                    keep = (i != j) & (d2 < r2)
+                    pairs_i.append(i[keep])
+                    pairs_j.append(j[keep])
+                    pairs_d2.append(d2[keep])
+
+    if not pairs_i:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, p.dtype)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_d2)
+
+# sum rows of values[j] into row i for every (i, j) pair
+def boids_np_sum_pairs(i, j, values, n):
+    sums = np.zeros((n, 3))
+    for k in range(3):
+        sums[:, k] = np.bincount(i, values[j, k], minlength=n)
+    return sums
+
+def boids_np_normalize(vecs):
+    length = np.sqrt(np.einsum('ij,ij->i', vecs, vecs))
+    return vecs / np.where(length > 0, length, 1)[:, None]
+
+# a step runs in three phases, in the same order as the python loop in
+# create_boids. each phase only updates the boids in own (a boolean mask, None
+# for all of them), so the parallel engine can split the boids between processes
+# and wait for each other in between
+
+# phase 1: find neighbors and the collision avoidance of every boid in own,
+# looking for neighbors among candidates. fills boids.sep for own, and returns
+# the neighbor data the later phases need
+def boids_np_phase_neighbors(boids, params, own=None, candidates=None):
+    n = len(boids)
+    p = boids.p
+    flocking = boids.state == 0
+
+    visual_r2 = params['visual_range'] ** 2
+    collision_r2 = params['collision_radius'] ** 2
+    i, j, d2 = boids_np_neighbor_pairs(p, max(params['visual_range'], params['collision_radius']), own, candidates)
+    near = d2 < visual_r2
+    near_i, near_j = i[near], j[near]
+    n_neighbors = np.bincount(near_i, minlength=n)
+    has_neighbors = flocking & (n_neighbors > 0)
+    n_neighbors = np.maximum(n_neighbors, 1)[:, None]
+    center = boids_np_sum_pairs(near_i, near_j, p, n) / n_neighbors
+
+    close = d2 < collision_r2
+    sep = p * np.bincount(i[close], minlength=n)[:, None] - boids_np_sum_pairs(i[close], j[close], p, n)
+    sep[~flocking] = 0
+    if own is None:
+        boids.sep[:] = sep
+    else:
+        boids.sep[own] = sep[own]
+    return near_i, near_j, n_neighbors, has_neighbors, center
+
+# phase 2: fly towards center and avoid collisions
+def boids_np_phase_cohesion(boids, params, own, work):
+    near_i, near_j, n_neighbors, has_neighbors, center = work
+    p, v = boids.p, boids.v
+    flocking = boids.state == 0
+    if own is not None:
+        flocking &= own
+
+    factor = 0.05 * params['fly_towards_center']
+    v[has_neighbors] += ((center - p) * factor)[has_neighbors]
+
+    # like in boids_flock, the correction keeps accumulating over the
+    # boids in index order, so this needs every boid's sep from phase 1
+    factor = 0.05 * params['avoid_collisions']
+    dv = np.cumsum(boids.sep, axis=0)
+    v[flocking] += (dv * factor)[flocking]
+
+# phase 3: match velocity, limit speed, stay in territory and change state.
+# the results go into the next_ arrays, so other processes can keep reading
+# this step's velocities
+def boids_np_phase_move(boids, params, own, work, random_numbers, beehives):
+    near_i, near_j, n_neighbors, has_neighbors, center = work
+    n = len(boids)
+    ix = np.arange(n) if own is None else np.flatnonzero(own)
+    roll, beehive, explore_v = (r[ix] for r in random_numbers)
+
+    # match velocity. neighbors are averaged before any boid is updated, where
+    # boids_flock sees the new velocity of lower-index neighbors
+    factor = 0.05 * params['match_velocity']
+    avg_v = (boids_np_sum_pairs(near_i, near_j, boids.v, n) / n_neighbors)[ix]
+    p, v, state, dest = boids.p[ix], boids.v[ix], boids.state[ix], boids.dest[ix]
+    flocking = state == 0
+    has_neighbors = has_neighbors[ix]
+    v[has_neighbors] += ((avg_v - v) * factor)[has_neighbors]
+
+    # limit speed
+    max_speed = params['max_speed']
+    speed = np.sqrt(np.einsum('ij,ij->i', v, v))
+    too_fast = speed > max_speed
+    v[too_fast] *= (max_speed / speed[too_fast])[:, None]
+
+    # stay in territory
+    factor = 1.0 * params['stay_in_territory'] * params['max_speed']/10
+    margin = 5
+    dist = p - np.asarray(params['territory_center'], dtype=p.dtype)
+    outside = flocking & (np.einsum('ij,ij->i', dist, dist) > params['territory_radius']**2)
+    v[outside] -= boids_np_normalize(dist[outside]) * factor
+    v[flocking & (p[:, 2] < margin), 2] += factor
+
+    # state transitions, all decided from the state at the start of the step
+    speed = np.sqrt(np.einsum('ij,ij->i', v, v))[:, None]
+
+    homing = flocking & (roll < params['homing_probability'])
+    dest[homing] = beehives[beehive[homing]]
+    v[homing] = boids_np_normalize(dest[homing] - p[homing]) * speed[homing]
+    state[homing] = 1
+
+    exploring = (state == 2) & (roll < params['exploring_probability'])
+    v[exploring] = explore_v[exploring]
+    state[exploring] = 0
+
+    seeking = state == 1
+    seeking[homing] = False
+    v[seeking] = boids_np_normalize(dest[seeking] - p[seeking]) * speed[seeking]
+    to_dest = p - dest
+    arrived = seeking & (np.einsum('ij,ij->i', to_dest, to_dest) < np.einsum('ij,ij->i', v, v))
+    p[arrived] = dest[arrived]
+    state[arrived] = 2
+
+    # save new pos
+    moving = state != 2
+    p[moving] += v[moving]
+    np.maximum(p[:, 2], 0, out=p[:, 2])
+
+    boids.next_p[ix] = p
+    boids.next_v[ix] = v
+    boids.next_state[ix] = state
+    boids.dest[ix] = dest
+
+# one simulation step for all boids
+def boids_np_step(boids, params, frame, beehives):
+    random_numbers = boids_np_random(params, frame, len(boids), len(beehives))
+    work = boids_np_phase_neighbors(boids, params)
+    boids_np_phase_cohesion(boids, params, None, work)
+    boids_np_phase_move(boids, params, None, work, random_numbers, beehives)
+    boids.swap()
+
+# run the whole simulation, see boids_frames
+def boids_np_frames(params):
+    workers = params.get('workers', 1)
+    if workers > 1:
+        if sys.platform.startswith('linux'):
+            yield from boids_np_parallel_frames(params, workers)
+            return
+        print("Parallel boids fork the Blender process, which is only safe on Linux. Running on one process")
+
+    rng = np.random.default_rng(params['seed'] % 2**32)
+    beehives = np.array(beehive_positions(), dtype=np.float32)
+    boids = boids_np_init(params, rng)
+
+    yield 0, boids.state, boids.p, boids.v
+    for frame in range(1, boids_n_frames(params)):
+        boids_np_step(boids, params, frame, beehives)
+        yield frame, boids.state, boids.p, boids.v
+
+### ==== PARALLEL BOIDS ==== ###
+# the territory is cut into slabs along x, one per worker process. all arrays
+# live in shared memory; each worker updates the boids in its slab and reads the
+# ghost boids within visual range of its borders straight from the shared arrays.
+# the random numbers only depend on seed and frame, so the result is the same
+# as the serial engine for any number of workers
+
+# boids owned by each of n_domains slabs, and the ones each needs to see:
+# its own plus the ghosts within neighbor radius of its borders. two
+# (n_domains, boids) masks
+def boids_np_domains(p, params, n_domains):
+    center_x = params['territory_center'][0]
+    r = params['territory_radius']
+    edges = np.linspace(center_x - r, center_x + r, n_domains + 1)
+    edges[0], edges[-1] = -np.inf, np.inf # boids outside the territory go to the outer slabs
+    lo, hi = edges[:-1, None], edges[1:, None]
+    radius = max(params['visual_range'], params['collision_radius'])
+    x = p[:, 0]
+    return (x >= lo) & (x < hi), (x >= lo - radius) & (x < hi + radius)
+
+# what every worker needs at the start of a step, prepared once by the parent
+# process in shared memory: the step's random numbers and the slab masks
+class BoidStepInputs:
+    def __init__(self, count, n_domains, alloc=np.zeros):
+        self.roll = alloc((count,), np.float64)
+        self.beehive = alloc((count,), np.int64)
+        self.explore_v = alloc((count, 3), np.float64)
+        self.own = alloc((n_domains, count), np.bool_)
+        self.candidates = alloc((n_domains, count), np.bool_)
+
+    def update(self, boids, params, frame, n_beehives):
+        self.roll[:], self.beehive[:], self.explore_v[:] = boids_np_random(params, frame, len(boids), n_beehives)
+        self.own[:], self.candidates[:] = boids_np_domains(boids.p, params, len(self.own))
+
+    @property
+    def random_numbers(self):
+        return self.roll, self.beehive, self.explore_v
+
+def boids_np_worker(boids, inputs, params, beehives, index, barrier):
+    try:
+        for frame in range(1, boids_n_frames(params)):
+            barrier.wait() # inputs are ready
+            own, candidates = inputs.own[index], inputs.candidates[index]
+            random_numbers = inputs.random_numbers
+            work = boids_np_phase_neighbors(boids, params, own, candidates)
+            barrier.wait()
+            boids_np_phase_cohesion(boids, params, own, work)
+            barrier.wait()
+            boids_np_phase_move(boids, params, own, work, random_numbers, beehives)
+            barrier.wait()
+            boids.swap()
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        barrier.abort()
+        raise
+
+# fork is only used on Linux. consumers that start threads, like
+# BackgroundConsumer, start them on the first frame, after the fork
+def boids_np_parallel_frames(params, n_workers):
+    ctx = multiprocessing.get_context('fork')
+    def alloc(shape, dtype):
+        size = int(np.prod(shape))
+        buffer = ctx.RawArray('b', max(size * np.dtype(dtype).itemsize, 1))
+        return np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+    rng = np.random.default_rng(params['seed'] % 2**32)
+    beehives = np.array(beehive_positions(), dtype=np.float32)
+    boids = boids_np_init(params, rng, alloc)
+    inputs = BoidStepInputs(len(boids), n_workers, alloc)
+
+    # the workers and this process meet once the inputs are ready and at the
+    # end of every phase
+    barrier = ctx.Barrier(n_workers + 1)
+    workers = [
+        ctx.Process(target=boids_np_worker, args=(boids, inputs, params, beehives, index, barrier), daemon=True)
+        for index in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        yield 0, boids.state, boids.p, boids.v
+        for frame in range(1, boids_n_frames(params)):
+            inputs.update(boids, params, frame, len(beehives))
+            for phase in range(4):
+                barrier.wait()
+            boids.swap()
+            yield frame, boids.state, boids.p, boids.v
+    except threading.BrokenBarrierError:
+        raise RuntimeError("A boid worker process failed")
+    finally:
+        barrier.abort()
+        for worker in workers:
+            worker.join()
+
+# print how the parallel engine scales from 1 to max_workers processes
+def boids_parallel_benchmark(params, count=20000, steps=20, max_workers=None):
+    params = dict(params, count=count, engine='NUMPY', animation_length=steps * params['animation_step'])
+    base = None
+    for workers in range(1, (max_workers or os.cpu_count()) + 1):
+        start = time.perf_counter()
+        for frame in boids_np_frames(dict(params, workers=workers)):
+            pass
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        print("{:>3} workers: {:>8.0f} boids/sec/step, {:.2f}x".format(workers, count * steps / elapsed, base / elapsed))
+
+### ==== END PARALLEL BOIDS ==== ###
+
+# print simulation throughput of each engine for a few swarm sizes
+def boids_benchmark(params, counts=(50, 500, 5000, 20000), steps=20):
+    params = dict(params, animation_length=steps * params['animation_step'])
+    for engine in ('PYTHON', 'NUMPY'):
+        for count in counts:
+            if engine == 'PYTHON' and count > 500:
+                continue
+            start = time.perf_counter()
+            for frame in boids_frames(dict(params, count=count, engine=engine)):
+                pass
+            elapsed = time.perf_counter() - start
+            print("{:>6} engine, {:>6} boids: {:>12.0f} boids/sec/step".format(engine, count, count * steps / elapsed))
+
+### ==== END NUMPY BOIDS ==== ###
+
+# the current state of a list of Boids as arrays, like the numpy engine keeps them
+def boids_snapshot(boids):
+    state = np.array([Boid.STATE_CODES[boid.state] for boid in boids], dtype=np.uint8)
+    p = np.array([boid.p for boid in boids], dtype=np.float32).reshape(-1, 3)
+    v = np.array([boid.v for boid in boids], dtype=np.float32).reshape(-1, 3)
+    return state, p, v
+
+# run the simulation one step at a time with the engine selected in params.
+# yields (frame, states, positions, velocities) with one row per boid. the
+# arrays may be reused for the next frame, so consumers copy what they keep
+def boids_frames(params):
+    if params.get('engine') == 'NUMPY':
+        yield from boids_np_frames(params)
+        return
+
+    random.seed(params['seed'])
+    beehive_pos = beehive_positions()
     boids = boids_init(params)
+    state, p, v = boids_snapshot(boids)
+    yield 0, state, p, v
 
-    for i in range(0, params['animation_length'], params['animation_step']):
+    for frame in range(1, boids_n_frames(params)):
         # print("=== STEP {}".format(i))
-        boids_fly_towards_center(boids, params)
-        boids_avoid_collisions(boids, params)
-        boids_match_velocity(boids, params)
+        # positions only change at the end of a step, so one grid serves every rule
+        grid = BoidGrid(boids, max(params['visual_range'], params['collision_radius']))
+        boids_flock(boids, params, grid)
         boids_limit_speed(boids, params)
         boids_stay_in_territory(boids, params)
         
@@ -974,13 +2171,400 @@ def create_boids(params):
                 boid.p += boid.v
                 
             boid.p.z = max(boid.p.z, 0)
-            boid.history.append( (boid.state, boid.p.copy(), boid.v.copy()) )
+        
+        state, p, v = boids_snapshot(boids)
+        yield frame, state, p, v
+
+# feed every frame of the simulation to each consumer as soon as it is computed,
+# so only what the consumers keep stays in memory. a consumer is anything with
+# consume(frame, state, p, v), finish() after the last frame and discard() to
+# release what it holds when the run fails.
+# with params['use_cache'], frames are replayed from the on-disk cache when the
+# same simulation has run before, and saved to it otherwise
+def boids_run(params, consumers):
+    frames = None
+    if params.get('use_cache'):
+        path = boids_cache_path(params)
+        frames = boids_cached_frames(path)
+        if frames is None:
+            consumers = consumers + [BoidCacheWriter(path, params)]
+        else:
+            print("Loaded boid trajectories from {}".format(path))
+    if frames is None:
+        frames = boids_frames(params)
+
+    complete = False
+    try:
+        for frame, state, p, v in frames:
+            for consumer in consumers:
+                consumer.consume(frame, state, p, v)
+        complete = True
+    finally:
+        # a generator left suspended would keep the parallel engine's workers
+        # waiting at their barrier until it happens to be collected
+        if hasattr(frames, 'close'):
+            frames.close()
+        boids_close(consumers, complete)
+
+# finish every consumer after a complete run, discard them all otherwise. a
+# consumer that fails to finish does not keep the others from finishing, and
+# the first error is raised at the end. errors while discarding are printed,
+# so they don't hide the one that stopped the run
+def boids_close(consumers, complete):
+    error = None
+    for consumer in consumers:
+        try:
+            if complete:
+                consumer.finish()
+            else:
+                consumer.discard()
+        except Exception as e:
+            if complete and error is None:
+                error = e
+            else:
+                print("Failed to close {}: {}".format(type(consumer).__name__, e))
+    if error is not None:
+        raise error
+
+# run the whole simulation and keep every frame
+def boids_simulate(params):
+    history = BoidHistory(boids_n_frames(params), params['count'])
+    boids_run(params, [history])
+    return history
+
+### ==== BOID CACHE ==== ###
+# finished simulations are kept as state.npy, p.npy and v.npy in a directory of
+# BOIDS_CACHE_DIR named after a hash of everything that affects the result
+
+def boids_cache_path(params):
+    # keys that only change how the result is drawn
+    key = {k: v for k, v in params.items() if k not in ('output', 'use_cache', 'workers')}
+    key['engine_version'] = BOIDS_ENGINE_VERSION
+    key = json.dumps(key, sort_keys=True, default=list)
+    return os.path.join(BOIDS_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest())
+
+# replay a cached simulation, or None if it is not cached
+def boids_cached_frames(path):
+    if not os.path.isdir(path):
+        return None
+    os.utime(path) # mark as recently used
+    state = np.load(os.path.join(path, "state.npy"), mmap_mode='r')
+    p = np.load(os.path.join(path, "p.npy"), mmap_mode='r')
+    v = np.load(os.path.join(path, "v.npy"), mmap_mode='r')
+    return ((frame, state[frame], p[frame], v[frame]) for frame in range(len(state)))
+
+# delete the least recently used simulations until the cache fits in max_bytes
+def boids_cache_evict(max_bytes=BOIDS_CACHE_MAX_BYTES):
+    entries = []
+    for name in os.listdir(BOIDS_CACHE_DIR):
+        if name.endswith(".tmp"):
+            continue # still being written by a BoidCacheWriter
+        path = os.path.join(BOIDS_CACHE_DIR, name)
+        try:
+            size = sum(f.stat().st_size for f in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+        except FileNotFoundError:
+            pass # evicted by another run meanwhile
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+# consumer that streams frames into memory-mapped .npy files, and moves them
+# into the cache once the simulation is complete. every writer has its own
+# temporary directory, so runs of the same simulation can overlap
+class BoidCacheWriter:
+    def __init__(self, path, params):
+        self.path = path
+        self.tmp_path = None
+        self.n_frames = boids_n_frames(params)
+        self.state = self.p = self.v = None
+
+    def consume(self, frame, state, p, v):
+        if self.state is None:
+            os.makedirs(BOIDS_CACHE_DIR, exist_ok=True)
+            self.tmp_path = tempfile.mkdtemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=BOIDS_CACHE_DIR)
+            n_frames = self.n_frames
+            open_memmap = np.lib.format.open_memmap
+            self.state = open_memmap(os.path.join(self.tmp_path, "state.npy"), 'w+', np.uint8, (n_frames, len(p)))
+            self.p = open_memmap(os.path.join(self.tmp_path, "p.npy"), 'w+', np.float32, (n_frames, len(p), 3))
+            self.v = open_memmap(os.path.join(self.tmp_path, "v.npy"), 'w+', np.float32, (n_frames, len(p), 3))
+        self.state[frame], self.p[frame], self.v[frame] = state, p, v
+
+    def finish(self):
+        for array in (self.state, self.p, self.v):
+            array.flush()
+        self.state = self.p = self.v = None
+        try:
+            os.rename(self.tmp_path, self.path)
+        except OSError:
+            # another run cached the same simulation first (FileExistsError
+            # on Windows, directory not empty elsewhere). keep that one
+            if not os.path.isdir(self.path):
+                self.discard()
+                raise
+            self.discard()
+        boids_cache_evict()
+
+    def discard(self):
+        self.state = self.p = self.v = None
+        if self.tmp_path is not None:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            self.tmp_path = None
+
+# consumer that runs another consumer on a worker thread, so that e.g. writing
+# a file overlaps with computing the next step. not for consumers that use bpy
+class BackgroundConsumer:
+    def __init__(self, consumer, max_pending=8):
+        self.consumer = consumer
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+        self.thread = None
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    self.consumer.consume(*item)
+                except Exception as e:
+                    self.error = e
+
+    def consume(self, frame, state, p, v):
+        # started on the first frame, once a parallel engine has forked its workers
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.pending.put((frame, state.copy(), p.copy(), v.copy()))
+
+    def stop(self):
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+
+    def finish(self):
+        self.stop()
+        if self.error is not None:
+            self.consumer.discard()
+            raise self.error
+        self.consumer.finish()
+
+    def discard(self):
+        self.stop()
+        self.consumer.discard()
+
+# consumer that appends each frame to a PC2 point cache
+class PointCacheWriter:
+    def __init__(self, filepath, params):
+        self.filepath = filepath
+        self.n_frames = boids_n_frames(params)
+        self.sample_rate = params['animation_step']
+        self.file = None
+        self.first = None # positions at frame 0
+
+    def consume(self, frame, state, p, v):
+        if self.file is None:
+            self.first = p.copy()
+            self.file = open(self.filepath, 'wb')
+            self.file.write(struct.pack('<12siiffi', b'POINTCACHE2\0', 1, len(p), 0, self.sample_rate, self.n_frames))
+        np.ascontiguousarray(p, dtype='<f4').tofile(self.file)
+
+    def finish(self):
+        self.file.close()
+        print("Wrote {} frames of {} bees to {}".format(self.n_frames, len(self.first), self.filepath))
+
+    # a partial cache would be read as garbage for the missing frames
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.filepath)
+
+# consumer that keeps per-frame state counts and mean speed
+class BoidStats:
+    def __init__(self):
+        self.state_counts = []
+        self.mean_speed = []
+
+    def consume(self, frame, state, p, v):
+        self.state_counts.append(np.bincount(state, minlength=len(Boid.STATES)))
+        self.mean_speed.append(float(np.sqrt(np.einsum('ij,ij->i', v, v)).mean()) if len(v) else 0.0)
+
+    def finish(self):
+        counts = ", ".join("{} {}".format(n, state) for n, state in zip(self.state_counts[-1], Boid.STATES))
+        print("Bees at the end: {}. Mean speed {:.2f}".format(counts, sum(self.mean_speed) / len(self.mean_speed)))
+
+    def discard(self):
+        pass
+
+# consumer that records the whole simulation, then animates one object per bee
+class KeyframeWriter:
+    def __init__(self, params):
+        self.params = params
+        self.history = BoidHistory(boids_n_frames(params), params['count'])
+
+    def consume(self, frame, state, p, v):
+        self.history.consume(frame, state, p, v)
+
+    def finish(self):
+        self.history.report()
+        meshes = gen_bee_meshes()
+        for boid in boids_from_history(self.history):
+            boid.draw(self.params, meshes)
+
+    def discard(self):
+        self.history = None
+
+# Boid objects for every column of a history, e.g. one filled by the numpy engine
+def boids_from_history(history):
+    boids = []
+    for ix in range(history.count):
+        name = "boid_{:04}".format(ix)
+        boids.append(Boid(name, Vector(history.p[0, ix]), Vector(history.v[0, ix]), history, ix))
+    return boids
+
+def swarm_cache_path():
+    if bpy.data.filepath:
+        return bpy.path.abspath("//bee_swarm.pc2")
+    return os.path.join(bpy.app.tempdir, "bee_swarm.pc2")
+
+# the bee body and both wings as a single mesh, so it can be instanced
+def gen_swarm_bee_mesh():
+    bm = bmesh.new()
+    body_scale = Matrix.Diagonal((0.75, 0.75, 1, 1))
+    size = {'radius': 1} if bpy.app.version >= (3, 0, 0) else {'diameter': 1}
+    bmesh.ops.create_uvsphere(bm, u_segments=32, v_segments=16, calc_uvs=True, matrix=body_scale, **size)
     
-    print("Pathing boids done")
-    for boid in boids:
-        boid.draw(params)
+    # same placement as the wing objects in Boid.draw
+    wing_mat = body_scale @ Matrix.Translation((0.0, -0.75, 0.46)) @ Matrix.Diagonal((3, 1, 3, 1))
+    for verts, faces in (gen_right_wing(), gen_left_wing()):
+        bm_verts = [bm.verts.new(wing_mat @ vert) for vert in verts]
+        for face in faces:
+            bm.faces.new([bm_verts[k] for k in face])
+    
+    mesh = bpy.data.meshes.new(name="Bee")
+    bm.to_mesh(mesh)
+    bm.free()
+    return mesh
+
+# one vertex per bee, moved by a Mesh Cache modifier reading every trajectory
+# from the file a PointCacheWriter wrote, with the bee mesh instanced on each vertex
+def draw_swarm(cache_writer, params):
+    filepath = cache_writer.filepath
+    positions = cache_writer.first
+    
+    mesh = bpy.data.meshes.new(name="Swarm")
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", positions.ravel())
+    mesh.update()
+    swarm = bpy.data.objects.new("Swarm", mesh)
+    bpy.context.scene.collection.objects.link(swarm)
+    
+    cache = swarm.modifiers.new(name="Trajectories", type='MESH_CACHE')
+    cache.cache_format = 'PC2'
+    cache.filepath = filepath
+    cache.time_mode = 'FRAME'
+    cache.frame_scale = 1 / params['animation_step'] # one cache sample per animation_step frames
+    
+    bee = bpy.data.objects.new("Swarm_Bee", gen_swarm_bee_mesh())
+    bpy.context.scene.collection.objects.link(bee)
+    bee.parent = swarm
+    swarm.instance_type = 'VERTS'
+
+def create_boids(params):
+    stats = BoidStats()
+    if params.get('output') == 'POINT_CACHE':
+        cache_writer = PointCacheWriter(swarm_cache_path(), params)
+        boids_run(params, [BackgroundConsumer(cache_writer), stats])
+        print("Pathing boids done")
+        draw_swarm(cache_writer, params)
+    else:
+        boids_run(params, [stats, KeyframeWriter(params)])
 
 ### === MAIN PANEL === ### 
+
+# axiom, branching rules and leaf rules of a flower
+def flower_lsystem(params):
+    axiom = lsystem_production("!(thickness)F(length*2)A").bind(**params)
+
+    rules = {
+        "A" : lsystem_production(
+            "!(thickness*1.73)?F(length)[&(branch_angle)F(length)A]/(94)[&(branch_angle)F(length)A]/(132.63)[&(branch_angle)F(length)A]").bind(**params),
+        "F" : lsystem_production("F(x*length_scale)", ("x",)).bind(**params),
+        "!" : lsystem_production("!(x*1.7)", ("x",)).bind(**params)
+    }
+
+    leaf_rules = {
+        "A" : lsystem_production("?[&(leaf_angle)L]/(120)[&(leaf_angle)L]/(120)[&(leaf_angle)L]").bind(**params)
+    }
+    return axiom, rules, leaf_rules
+
+# objects, vertices, faces and RAM that drawing flower_count flowers will
+# create, from the symbol counts of the L-string. instancing is not counted
+def flowers_estimate(params, flower_count):
+    axiom, rules, leaf_rules = flower_lsystem(params)
+    counts = LSystem.count_symbols(LSystem.symbol_counts(axiom), rules, params['n_iter'])
+    counts = LSystem.count_symbols(counts, leaf_rules, 1)
+
+    # every F is a branch plus the leaf Branch.gen_branch puts halfway
+    branches = counts.get('F', 0) * flower_count
+    leaves = counts.get('L', 0) * flower_count
+    leaf_verts, leaf_faces = LEAF_LIBRARY.shape(params['leaf_type'])[:2]
+    branch_leaf_verts, branch_leaf_faces = LEAF_LIBRARY.shape(1)[:2]
+    ring = len(Branch.verts)
+    verts = branches * (2 * ring + len(branch_leaf_verts)) + leaves * len(leaf_verts)
+    faces = branches * (ring + 1 + len(branch_leaf_faces)) + leaves * len(leaf_faces)
+    objects = 2 * branches + leaves
+    if params['interpreter'] == 'BUFFERS':
+        # branches are merged into one mesh per flower, and so are baked leaves
+        objects = flower_count + branches + leaves
+        if params['leaf_bake']:
+            objects = 2 * flower_count
+    return {
+        'symbols' : sum(counts.values()) * flower_count,
+        'branches' : branches,
+        'leaves' : leaves, # drawn by L
+        'branch_leaves' : branches, # the one Branch.gen_branch puts halfway along every branch
+        'objects' : objects,
+        'verts' : verts,
+        'faces' : faces,
+        'bytes' : objects * OBJECT_BYTES + verts * VERT_BYTES + faces * FACE_BYTES,
+    }
+
+def flower_leaf_type(mytool):
+    if mytool.leaf_margin == 'SHAPE':
+        return int(mytool.leaf_type) - 1
+    return leaf_contour.LeafContour(mytool.leaf_margin, mytool.leaf_resolution, mytool.leaf_width, mytool.leaf_teeth, mytool.leaf_depth)
+
+def flower_params(mytool):
+    return {
+        'n_iter' : mytool.n_iter, # number of iterations
+        'length' : mytool.branch_length, # scales lengths of all branches
+        'length_scale' : mytool.branch_length_scale, # scales lengths of lower-order branches relative to higher-order ones
+        'thickness' : mytool.branch_thickness, # scales thicknesses of all branches
+        # thickness_scale is not paramaterized since it depends on branching rules
+        'branch_angle' : mytool.branch_angle, # branching angle, in degrees
+        'leaf_angle' : mytool.leaf_branch_angle, # Angle between leaf and branch
+        'leaf_scale' : mytool.leaf_scale, # Scaling factor for leaf
+        'leaf_bend' : mytool.leaf_bend, # Bend angle for leaf
+        'leaf_bake' : mytool.leaf_bake, # Twist leaf meshes instead of adding modifiers
+        'leaf_color' : tuple(mytool.leaf_color), # leaf color before variation
+        'leaf_hue_range' : mytool.leaf_hue_range, # how far leaf hues vary
+        'leaf_value_range' : mytool.leaf_value_range, # how far leaf brightness varies
+        'leaf_color_seed' : mytool.leaf_color_seed, # random seed for leaf colors
+        'leaf_type': flower_leaf_type(mytool), # leaf type, index of a hand-made shape or a LeafContour
+        'tropism' : mytool.tropism, # direction to bend branches towards
+        'tropism_scale' : mytool.tropism_scale, # strength of bending force
+        'seed' : mytool.seed, # random seed
+        'expansion' : mytool.lstring_expansion, # 'ARRAY', 'STREAM' or 'DAG'
+        'interpreter' : mytool.flower_interpreter, # 'TURTLE' or 'BUFFERS'
+    }
     
 class TreeGen(bpy.types.Operator):
     bl_idname = "object.tree_gen"
@@ -995,44 +2579,48 @@ class TreeGen(bpy.types.Operator):
         print("Planting flowers.....")
         
         mytool = context.scene.my_tool
-        params = {
-            'n_iter' : mytool.n_iter, # number of iterations
-            'length' : mytool.branch_length, # scales lengths of all branches
-            'length_scale' : mytool.branch_length_scale, # scales lengths of lower-order branches relative to higher-order ones
-            'thickness' : mytool.branch_thickness, # scales thicknesses of all branches
-            # thickness_scale is not paramaterized since it depends on branching rules
-            'branch_angle' : mytool.branch_angle, # branching angle, in degrees
-            'leaf_angle' : mytool.leaf_branch_angle, # Angle between leaf and branch
-            'leaf_scale' : mytool.leaf_scale, # Scaling factor for leaf
-            'leaf_bend' : mytool.leaf_bend, # Bend angle for leaf
-            'leaf_type': int(mytool.leaf_type) - 1, # leaf type
-            'tropism' : mytool.tropism, # direction to bend branches towards
-            'tropism_scale' : mytool.tropism_scale, # strength of bending force
-            'seed' : mytool.seed # random seed
-        }
+        params = flower_params(mytool)
         
-        axiom = LSystem.parse_lstring("!({thickness})F({length2})A".format(**params, length2=params['length']*2))
-
-        rules = {
-            "A" : LSystem.parse_lstring(
-                "!({th})?F({length})[&({branch_angle})F({length})A]/(94)[&({branch_angle})F({length})A]/(132.63)[&({branch_angle})F({length})A]".format(**params, th=params['thickness']*1.73)),
-            "F" : [lambda F: LNode("F", F.params[0] * params['length_scale'])],
-            "!" : [lambda n: LNode("!", n.params[0] * 1.7)]
-        }
-        lstring = LSystem.generate_lstring(axiom, rules, params['n_iter'])
+        estimate = flowers_estimate(params, mytool.flower_count)
+        if estimate['bytes'] > FLOWERS_MAX_BYTES:
+            self.report({'ERROR'}, "Flowers would need about {:.1f} GB, lower Level Count or Count".format(estimate['bytes'] / 2**30))
+            return {'CANCELLED'}
+        if estimate['objects'] > FLOWERS_WARN_OBJECTS:
+            self.report({'WARNING'}, "Creating about {:,.0f} flower objects, this can take a while".format(estimate['objects']))
         
-        # second pass--add leaves
-        leaf_rules = {
-            "A" : LSystem.parse_lstring("?[&({leaf_angle})L]/(120)[&({leaf_angle})L]/(120)[&({leaf_angle})L]".format(**params))
-        }
-        lstring = LSystem.generate_lstring(lstring, leaf_rules, 1)
+        axiom, rules, leaf_rules = flower_lsystem(params)
+        if params['expansion'] == 'ARRAY':
+            lstring = LSystem.generate_lstring(axiom, rules, params['n_iter'])
+            
+            # second pass--add leaves
+            lstring = LSystem.generate_lstring(lstring, leaf_rules, 1)
+        elif params['expansion'] == 'DAG':
+            lstring = LSystem.expand_dag(LSystem.expand_dag(axiom, rules, params['n_iter']), leaf_rules, 1)
+        
+        instancer = None
+        if mytool.instance_repeats:
+            if params['expansion'] == 'DAG':
+                instancer = SubtreeInstancer(lstring, copies=mytool.flower_count)
+            else:
+                print("Instance Repeats needs the Shared expansion, drawing every subtree")
         
         random.seed(params['seed'])
         flower_locations = []
         for num_flowers in range(mytool.flower_count):
             pos = Vector([random.randrange(-SCENE_SIZE/2, SCENE_SIZE/2), random.randrange(-SCENE_SIZE/2, SCENE_SIZE/2), 0])
-            LSystem.draw_lstring(lstring, pos, **params) 
+            if params['expansion'] == 'STREAM':
+                # expanded again for every flower, leaves are added on the way out
+                lstring = LSystem.expand_lstring(LSystem.expand_lstring(axiom, rules, params['n_iter']), leaf_rules, 1)
+            if instancer:
+                instancer.draw(lstring, pos, num_flowers, **params)
+            elif params['interpreter'] == 'BUFFERS':
+                buffers = lsystem_turtle.interpret_lstring(lstring, pos, **params)
+                LSystem.draw_buffers(buffers, num_flowers, **params)
+            else:
+                LSystem.draw_lstring(lstring, pos, num_flowers, **params) 
             flower_locations.append(pos)
+        if instancer:
+            print("Built {} subtrees for {} instances".format(len(instancer.built), instancer.n_instances))
             
         print("Hatching bees...")
         boid_params = {
@@ -1046,6 +2634,10 @@ class TreeGen(bpy.types.Operator):
             'homing_probability' : mytool.bee_homing_probability,   # how often will bees decide to go home (0 to 1)
             'exploring_probability' : mytool.bee_exploring_probability, # how often will bees at home decide to leave (0 to 1)
             'seed' : mytool.bee_seed,            # Random seed
+            'engine' : mytool.bee_engine,        # 'NUMPY' or 'PYTHON'
+            'workers' : mytool.bee_workers,      # processes for the NUMPY engine, results do not depend on it
+            'output' : mytool.bee_output,        # 'OBJECTS' or 'POINT_CACHE'
+            'use_cache' : True,                  # reuse trajectories from an earlier run with the same settings
 
             # dont paramaterize these
             'animation_step' : 5,
@@ -1055,7 +2647,7 @@ class TreeGen(bpy.types.Operator):
             'territory_radius' : 40,
         }
 #        test_boid = Boid("test_boid", Vector((0,0,0)), Vector((1,0,0)))
-#        test_boid.draw(boid_params)
+#        test_boid.draw(boid_params, gen_bee_meshes())
         
         create_boids(params=boid_params)
         
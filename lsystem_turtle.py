@@ -0,0 +1,246 @@
+'''
+
+Headless turtle for lsystem.py. Interprets an L-string into flat arrays of
+branch segments and leaf transforms instead of Blender objects, so it runs
+(and can be tested and benchmarked) without bpy. lsystem.py builds the
+geometry from these arrays in a separate step.
+
+'''
+from math import *
+import functools
+import random
+import time
+import numpy as np
+
+def cross(a, b):
+    return [a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0]]
+
+def normalized(a):
+    length = sqrt(a[0]*a[0] + a[1]*a[1] + a[2]*a[2])
+    return [a[0] / length, a[1] / length, a[2] / length]
+
+# 3x3 matrices are row-major tuples of 9 floats
+def matmul(a, b):
+    return (
+        a[0]*b[0] + a[1]*b[3] + a[2]*b[6], a[0]*b[1] + a[1]*b[4] + a[2]*b[7], a[0]*b[2] + a[1]*b[5] + a[2]*b[8],
+        a[3]*b[0] + a[4]*b[3] + a[5]*b[6], a[3]*b[1] + a[4]*b[4] + a[5]*b[7], a[3]*b[2] + a[4]*b[5] + a[5]*b[8],
+        a[6]*b[0] + a[7]*b[3] + a[8]*b[6], a[6]*b[1] + a[7]*b[4] + a[8]*b[7], a[6]*b[2] + a[7]*b[5] + a[8]*b[8],
+    )
+
+# rotation about x (0), y (1) or z (2), the same as turtle_rotation in lsystem.py
+@functools.lru_cache(maxsize=256)
+def axis_rotation(axis, deg):
+    c = cos(deg/180*pi)
+    s = sin(deg/180*pi)
+    if axis == 0:
+        return (1, 0, 0, 0, c, -s, 0, s, c)
+    if axis == 1:
+        return (c, 0, s, 0, 1, 0, -s, 0, c)
+    return (c, -s, 0, s, c, 0, 0, 0, 1)
+
+# rotation by angle (radians) around the unit vector axis, like
+# Matrix.Rotation(angle, 3, axis) in mathutils
+def rotation(axis, angle):
+    c = cos(angle)
+    s = sin(angle)
+    t = 1 - c
+    x, y, z = axis
+    return (
+        t*x*x + c, t*x*y - s*z, t*x*z + s*y,
+        t*x*y + s*z, t*y*y + c, t*y*z - s*x,
+        t*x*z - s*y, t*y*z + s*x, t*z*z + c,
+    )
+
+# everything a flower is made of. frames are 3x3 matrices with h, l and u as
+# columns, like Turtle builds them for to_euler
+class TurtleBuffers:
+    def __init__(self, segment_start, segment_end, segment_frame, segment_thickness, segment_parent, leaf_position, leaf_frame):
+        self.segment_start = segment_start # (n, 3)
+        self.segment_end = segment_end # (n, 3)
+        self.segment_frame = segment_frame # (n, 3, 3), at the start of the segment
+        self.segment_thickness = segment_thickness # (n,)
+        self.segment_parent = segment_parent # (n,), segment that ended where this one starts, -1 if none
+        self.leaf_position = leaf_position # (m, 3)
+        self.leaf_frame = leaf_frame # (m, 3, 3)
+
+# same interpretation as Turtle in lsystem.py, recording instead of drawing
+class HeadlessTurtle:
+    def __init__(self, tropism=None, tropism_scale=0, pos=(0, 0, 0), **params):
+        # pushed to stack. pos and basis are replaced, never modified in
+        # place, so the stack can hold them without copies
+        self.pos = list(pos)
+        self.basis = (0, 1, 0, 0, 0, 1, 1, 0, 0) # columns h (heading) = z, l (direction left) = x, u (direction up) = y
+        self.thickness = 0.05
+        self.segment = -1 # last segment drawn, it ends at pos
+
+        # not pushed to stack because they never change
+        self.tropism = list(tropism) if tropism else None
+        self.tropism_scale = tropism_scale
+        self.params = params
+
+        self.stack = []
+        self.segments = [] # (start, end, basis, thickness, parent)
+        self.leaves = [] # (pos, basis)
+
+    @property
+    def h(self):
+        return [self.basis[0], self.basis[3], self.basis[6]]
+
+    # rotating about one of the frame's own axes is a rotation about x, y or z
+    # applied on the right of the basis
+    def rotate_h(self, deg):
+        self.basis = matmul(self.basis, axis_rotation(0, deg))
+
+    def rotate_l(self, deg):
+        self.basis = matmul(self.basis, axis_rotation(1, deg))
+
+    def rotate_u(self, deg):
+        self.basis = matmul(self.basis, axis_rotation(2, deg))
+
+    def rotate_horizontal(self):
+        h = self.h
+        l = normalized(cross([0, 0, 1], h))
+        u = cross(h, l)
+        self.basis = (h[0], l[0], u[0], h[1], l[1], u[1], h[2], l[2], u[2])
+
+    def draw(self, dist):
+        h = self.h
+        end = [self.pos[0] + dist * h[0], self.pos[1] + dist * h[1], self.pos[2] + dist * h[2]]
+        self.segments.append((self.pos, end, self.basis, self.thickness, self.segment))
+        self.pos = end
+        self.segment = len(self.segments) - 1
+
+        if self.tropism and self.tropism_scale:
+            torque = cross(h, self.tropism)
+            length = sqrt(torque[0]*torque[0] + torque[1]*torque[1] + torque[2]*torque[2])
+            if length > 0.0001:
+                theta = asin(min(length, 1))
+                torque = [x / length for x in torque]
+                self.basis = matmul(rotation(torque, theta * self.tropism_scale), self.basis)
+
+    def draw_leaf(self):
+        self.leaves.append((self.pos, self.basis))
+
+    def push_state(self):
+        self.stack.append((self.pos, self.basis, self.thickness, self.segment))
+
+    def pop_state(self):
+        self.pos, self.basis, self.thickness, self.segment = self.stack.pop()
+
+    def interpret(self, lnode):
+        l, params = lnode.l, lnode.params
+        if l == 'F':
+            self.draw(params[0])
+        elif l == '[':
+            self.push_state()
+        elif l == ']':
+            self.pop_state()
+        elif l == '/':
+            self.rotate_h(params[0])
+        elif l == '\\':
+            self.rotate_h(-params[0])
+        elif l == '+':
+            self.rotate_u(params[0])
+        elif l == '-':
+            self.rotate_u(-params[0])
+        elif l == '&':
+            self.rotate_l(params[0])
+        elif l == '^':
+            self.rotate_l(-params[0])
+        elif l == '$':
+            self.rotate_horizontal()
+        elif l == '?':
+            # a random angle is never reused, so it skips axis_rotation's cache
+            self.basis = matmul(self.basis, rotation((1, 0, 0), 2*pi*random.random()))
+        elif l == '!':
+            self.thickness = params[0]
+        elif l == 'L':
+            self.draw_leaf()
+
+    def buffers(self):
+        segments = np.array([start + end + list(basis) + [thickness] for start, end, basis, thickness, parent in self.segments], dtype=np.float64).reshape(-1, 16)
+        leaves = np.array([pos + list(basis) for pos, basis in self.leaves], dtype=np.float64).reshape(-1, 12)
+        return TurtleBuffers(
+            segment_start=segments[:, 0:3],
+            segment_end=segments[:, 3:6],
+            segment_frame=segments[:, 6:15].reshape(-1, 3, 3),
+            segment_thickness=segments[:, 15],
+            segment_parent=np.array([parent for start, end, basis, thickness, parent in self.segments], dtype=np.int64),
+            leaf_position=leaves[:, 0:3],
+            leaf_frame=leaves[:, 3:12].reshape(-1, 3, 3),
+        )
+
+# lstring is any iterable of LNodes, params are the ones LSystem.draw_lstring takes
+def interpret_lstring(lstring, pos=(0, 0, 0), **params):
+    turtle = HeadlessTurtle(pos=pos, **params)
+    for lnode in lstring:
+        turtle.interpret(lnode)
+    return turtle.buffers()
+
+# one mesh with all branches of a flower. every segment is a tube between two
+# rings of profile, a (k, 2) cross-section in the segment's l/u plane scaled by
+# its thickness. a segment that continues its parent with the same thickness,
+# heading within share_angle degrees of it, starts from the parent's end ring
+# instead of a new one. that ring is square to the parent, so anything turned
+# further, like a side branch, gets its own ring and cap. returns vertices, loop vertex
+# indices, and the first loop and loop count of every polygon
+def branch_mesh(buffers, profile, share_angle=10):
+    n = len(buffers.segment_start)
+    k = len(profile)
+    parent = buffers.segment_parent
+    thickness = buffers.segment_thickness
+
+    # of the children close enough to straight ahead with the same
+    # thickness, the straightest continues its parent
+    heading = buffers.segment_frame[:, :, 0]
+    children = np.flatnonzero(parent >= 0)
+    children = children[thickness[parent[children]] == thickness[children]]
+    straight = np.einsum('ij,ij->i', heading[parent[children]], heading[children])
+    keep = straight > cos(radians(share_angle))
+    children, straight = children[keep], straight[keep]
+    children = children[np.lexsort((-straight, parent[children]))]
+    first = np.unique(parent[children], return_index=True)[1]
+    shares = np.zeros(n, dtype=bool)
+    shares[children[first]] = True
+    continued = np.zeros(n, dtype=bool)
+    continued[parent[shares]] = True
+
+    # ring i is the end of segment i, rings from n on start the segments that don't share
+    own_start = np.flatnonzero(~shares)
+    start_ring = np.empty(n, dtype=np.int64)
+    start_ring[shares] = parent[shares]
+    start_ring[own_start] = n + np.arange(len(own_start))
+    end_ring = np.arange(n)
+
+    centers = np.concatenate((buffers.segment_end, buffers.segment_start[own_start]))
+    frames = np.concatenate((buffers.segment_frame, buffers.segment_frame[own_start]))
+    radius = np.concatenate((thickness, thickness[own_start]))[:, None, None]
+    profile = np.asarray(profile, dtype=np.float64)
+    l = frames[:, None, :, 1]
+    u = frames[:, None, :, 2]
+    verts = centers[:, None, :] + radius * (profile[None, :, 0, None] * l + profile[None, :, 1, None] * u)
+
+    # side quads wind counterclockwise around h, so their normals point out
+    j = np.arange(k)
+    j1 = (j + 1) % k
+    a = start_ring[:, None] * k
+    b = end_ring[:, None] * k
+    quads = np.stack((a + j, a + j1, b + j1, b + j), axis=2)
+    start_caps = (n + np.arange(len(own_start)))[:, None] * k + j[::-1]
+    end_caps = np.flatnonzero(~continued)[:, None] * k + j
+
+    loops = np.concatenate((quads.ravel(), start_caps.ravel(), end_caps.ravel()))
+    loop_total = np.concatenate((np.full(n * k, 4), np.full(len(start_caps) + len(end_caps), k)))
+    loop_start = np.cumsum(loop_total) - loop_total
+    return verts.reshape(-1, 3), loops, loop_start, loop_total
+
+# print the interpretation rate of HeadlessTurtle over lstring
+def benchmark(lstring, repeat=5, **params):
+    lnodes = list(lstring)
+    start = time.perf_counter()
+    for i in range(repeat):
+        turtle = HeadlessTurtle(**params)
+        for lnode in lnodes:
+            turtle.interpret(lnode)
+    elapsed = time.perf_counter() - start
+    print("{} symbols: {:.0f} symbols/sec".format(len(lnodes), len(lnodes) * repeat / elapsed))
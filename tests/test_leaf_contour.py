@@ -0,0 +1,81 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import leaf_contour
+
+CONTOURS = [
+    leaf_contour.LeafContour(margin, resolution, 0.3, teeth, depth)
+    for margin in leaf_contour.MARGINS
+    for resolution, teeth, depth in ((24, 5, 0.3), (8, 1, 0.95), (1, 0, 0), (1024, 64, 0.5))
+]
+
+def shape(contour):
+    verts, faces, uvs = leaf_contour.contour_shape(contour)
+    return verts.astype(np.float64), np.array(faces), np.array(uvs)
+
+# twice the signed area of every triangle in the xz plane, positive when counterclockwise
+def triangle_areas(verts, faces):
+    x, z = verts[:, 0], verts[:, 2]
+    a, b, c = faces.T
+    return (x[b] - x[a]) * (z[c] - z[a]) - (z[b] - z[a]) * (x[c] - x[a])
+
+# the outline in order: every vertex for midrib leaves, all but the center for palmate ones
+def outline(contour, verts):
+    return verts[1:] if contour.margin == 'PALMATE' else verts
+
+def shoelace(points):
+    x, z = points[:, 0], points[:, 2]
+    return (x * np.roll(z, -1) - np.roll(x, -1) * z).sum()
+
+@pytest.mark.parametrize('contour', CONTOURS)
+def test_faces_are_valid_triangles(contour):
+    verts, faces, uvs = shape(contour)
+    assert faces.shape[1] == 3
+    assert faces.min() == 0 and faces.max() == len(verts) - 1
+    assert len(uvs) == len(verts)
+    assert all(len(set(face)) == 3 for face in faces.tolist())
+
+@pytest.mark.parametrize('contour', CONTOURS)
+def test_triangles_are_counterclockwise(contour):
+    verts, faces, uvs = shape(contour)
+    assert (triangle_areas(verts, faces) > 0).all()
+
+@pytest.mark.parametrize('contour', CONTOURS)
+def test_triangles_cover_the_outline(contour):
+    verts, faces, uvs = shape(contour)
+    np.testing.assert_allclose(triangle_areas(verts, faces).sum(), shoelace(outline(contour, verts)), rtol=1e-9)
+
+@pytest.mark.parametrize('contour', CONTOURS)
+def test_shape_is_flat_with_the_tip_at_one(contour):
+    verts, faces, uvs = shape(contour)
+    assert (verts[:, 1] == 0).all()
+    assert verts[:, 2].max() == pytest.approx(1)
+    assert uvs.min() >= 0 and uvs.max() <= 1
+
+@pytest.mark.parametrize('margin', ['ENTIRE', 'PALMATE'])
+def test_minimum_resolution(margin):
+    verts, faces, uvs = shape(leaf_contour.LeafContour(margin, 1, 0.3, 5, 0.3))
+    # midrib leaves get 2 rows: base, one vertex per side and the tip. palmate leaves 8 around a center
+    assert len(verts) == (4 if margin == 'ENTIRE' else 9)
+    assert len(faces) == (2 if margin == 'ENTIRE' else 8)
+
+@pytest.mark.parametrize('margin', ['SERRATED', 'LOBED'])
+def test_zero_depth_is_an_entire_margin(margin):
+    entire = leaf_contour.contour_shape(leaf_contour.LeafContour('ENTIRE', 24, 0.3, 5, 0))
+    cut = leaf_contour.contour_shape(leaf_contour.LeafContour(margin, 24, 0.3, 5, 0))
+    np.testing.assert_array_equal(cut[0], entire[0])
+    assert cut[1] == entire[1]
+
+@pytest.mark.parametrize('margin', ['SERRATED', 'LOBED'])
+def test_zero_teeth_keeps_a_valid_shape(margin):
+    verts, faces, uvs = shape(leaf_contour.LeafContour(margin, 24, 0.3, 0, 0.5))
+    assert np.isfinite(verts).all()
+    assert (triangle_areas(verts, faces) > 0).all()
+
+def test_unknown_margin():
+    with pytest.raises(ValueError):
+        leaf_contour.contour_shape(leaf_contour.LeafContour('WAVY', 24, 0.3, 5, 0.3))
@@ -0,0 +1,98 @@
+import collections
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lsystem_turtle
+
+# stands in for lsystem.LNode, which needs bpy
+Node = collections.namedtuple('Node', ['l', 'params'])
+
+SQUARE = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+def lstring(text):
+    nodes = []
+    for symbol in text.split():
+        if '(' in symbol:
+            l, arg = symbol.rstrip(')').split('(')
+            nodes.append(Node(l, (float(arg),)))
+        else:
+            nodes.append(Node(symbol, ()))
+    return nodes
+
+def random_tree(seed, n=400):
+    rng = random.Random(seed)
+    text = []
+    depth = 0
+    for i in range(n):
+        choice = rng.random()
+        if choice < 0.4:
+            text.append("F({})".format(rng.uniform(0.5, 2)))
+        elif choice < 0.6:
+            text.append(rng.choice("+-&^/\\") + "({})".format(rng.uniform(5, 60)))
+        elif choice < 0.7:
+            text.append("[")
+            depth += 1
+        elif choice < 0.8 and depth:
+            text.append("]")
+            depth -= 1
+        elif choice < 0.9:
+            text.append("!({})".format(rng.choice((0.05, 0.1))))
+        else:
+            text.append("L")
+    return lstring(" ".join(text + ["]"] * depth))
+
+def polygons(mesh):
+    verts, loops, loop_start, loop_total = mesh
+    return [loops[start:start + total] for start, total in zip(loop_start, loop_total)]
+
+def directed_edges(mesh):
+    edges = collections.Counter()
+    for face in polygons(mesh):
+        for a, b in zip(face, np.roll(face, -1)):
+            edges[a, b] += 1
+    return edges
+
+def test_segment_and_leaf_counts():
+    buffers = lsystem_turtle.interpret_lstring(lstring("F(1) F(1) [ &(30) F(1) L ] F(2) L L"))
+    assert len(buffers.segment_start) == 4
+    assert len(buffers.leaf_position) == 3
+    assert buffers.segment_parent.tolist() == [-1, 0, 1, 1]
+    np.testing.assert_allclose(buffers.segment_end[3] - buffers.segment_start[3], [0, 0, 2], atol=1e-12)
+
+def test_frames_stay_orthonormal():
+    buffers = lsystem_turtle.interpret_lstring(random_tree(1), tropism=(0, 0, -1), tropism_scale=0.2)
+    frames = buffers.segment_frame
+    gram = np.einsum('nji,njk->nik', frames, frames)
+    np.testing.assert_allclose(gram, np.broadcast_to(np.eye(3), gram.shape), atol=1e-9)
+
+def test_side_branch_gets_its_own_ring():
+    buffers = lsystem_turtle.interpret_lstring(lstring("F(1) F(1) [ &(35) F(1) ] F(1)"))
+    verts, loops, loop_start, loop_total = lsystem_turtle.branch_mesh(buffers, SQUARE)
+    # 4 end rings, plus start rings for the first segment and the side branch
+    assert len(verts) == 6 * len(SQUARE)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_branch_mesh_is_closed_and_consistently_wound(seed):
+    buffers = lsystem_turtle.interpret_lstring(random_tree(seed), tropism=(0, 0, -1), tropism_scale=0.2)
+    mesh = lsystem_turtle.branch_mesh(buffers, SQUARE)
+    verts, loops, loop_start, loop_total = mesh
+    assert loops.max() < len(verts)
+
+    edges = directed_edges(mesh)
+    # every edge is used by exactly two faces, once in each direction
+    assert max(edges.values()) == 1
+    assert all((b, a) in edges for a, b in edges)
+
+def test_branch_mesh_faces_point_out():
+    buffers = lsystem_turtle.interpret_lstring(lstring("F(1)"))
+    verts, loops, loop_start, loop_total = mesh = lsystem_turtle.branch_mesh(buffers, SQUARE)
+    center = (buffers.segment_start[0] + buffers.segment_end[0]) / 2
+    for face in polygons(mesh):
+        corners = verts[face]
+        normal = np.cross(corners[1] - corners[0], corners[2] - corners[1])
+        assert np.dot(normal, corners.mean(axis=0) - center) > 0